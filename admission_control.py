@@ -0,0 +1,226 @@
+import json
+import math
+import os
+import threading
+import time
+from flask import current_app, g, request, Response
+
+from metrics import ADMISSION_DECISIONS
+from response_cache import response_cache
+from fleet_refresh import fleet_refresher
+
+# Routes that can call WeatherAPI or run the forest -> (global rate per second, burst)
+EXPENSIVE_ROUTES = {
+    '/get_enhanced_predictions/<river_name>': (20, 40),
+    '/get_weather_data/<river_name>': (20, 40),
+    '/test_weather/<river_name>': (1, 5),
+    '/predict_debris': (20, 40),
+    '/early_warning/fleet': (2, 5),
+    '/refresh_fleet': (0.1, 2)
+}
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate  # Tokens added per second
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+    
+    def take(self, now=None):
+        """Take a token, returning 0 if admitted or the seconds until one is available"""
+        now = now if now is not None else time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+    
+    def refund(self):
+        """Give back a token taken for a request that was not admitted after all"""
+        self.tokens = min(self.burst, self.tokens + 1)
+
+def check_limits(name, rate, burst):
+    """Validate a (rate, burst) pair, since a zero rate would divide by zero in TokenBucket.take"""
+    if isinstance(rate, bool) or isinstance(burst, bool) or \
+            not isinstance(rate, (int, float)) or not isinstance(burst, (int, float)):
+        raise ValueError(f"{name}: rate and burst must be numbers, got {rate!r} and {burst!r}")
+    if rate <= 0 or burst < 1:
+        raise ValueError(f"{name}: rate must be above 0 and burst at least 1, got {rate!r} and {burst!r}")
+    return float(rate), float(burst)
+
+def parse_route_limits(raw):
+    """Route limits from ADMISSION_ROUTE_LIMITS JSON, e.g. {"/early_warning/fleet": [5, 10]}"""
+    try:
+        limits = json.loads(raw or '{}')
+    except ValueError as exc:
+        raise ValueError(f"ADMISSION_ROUTE_LIMITS is not valid JSON: {exc}") from None
+    if not isinstance(limits, dict):
+        raise ValueError("ADMISSION_ROUTE_LIMITS must be a JSON object of route -> [rate, burst]")
+    
+    parsed = {}
+    for route, pair in limits.items():
+        if not isinstance(pair, list) or len(pair) != 2:
+            raise ValueError(f"ADMISSION_ROUTE_LIMITS['{route}'] must be [rate, burst], got {pair!r}")
+        parsed[route] = check_limits(f"ADMISSION_ROUTE_LIMITS['{route}']", *pair)
+    return parsed
+
+class AdmissionController:
+    def __init__(self, routes=None):
+        self.enabled = os.environ.get('ADMISSION_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+        # ADMISSION_ROUTE_LIMITS overrides route limits as JSON: {"/early_warning/fleet": [5, 10]}
+        self.routes = {route: check_limits(route, *limits) for route, limits in
+                       (routes if routes is not None else EXPENSIVE_ROUTES).items()}
+        self.routes.update(parse_route_limits(os.environ.get('ADMISSION_ROUTE_LIMITS')))
+        # Per client and route
+        self.client_rate, self.client_burst = check_limits('ADMISSION_CLIENT_RATE/ADMISSION_CLIENT_BURST',
+                                                           float(os.environ.get('ADMISSION_CLIENT_RATE', 1)),
+                                                           float(os.environ.get('ADMISSION_CLIENT_BURST', 10)))
+        self.max_concurrent = int(os.environ.get('ADMISSION_MAX_CONCURRENT', 8))
+        self.queue_timeout = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 0.5))  # Wait for a slot this long
+        # Proxies in front of the app (Render adds one); their X-Forwarded-For entries are trusted
+        self.trusted_proxies = int(os.environ.get('TRUSTED_PROXY_HOPS', 0))
+        self.route_buckets = {route: TokenBucket(rate, burst) for route, (rate, burst) in self.routes.items()}
+        self.client_buckets = {}  # (client, route) -> TokenBucket
+        self.max_clients = 10000  # Idle buckets are pruned beyond this
+        self.slots = threading.BoundedSemaphore(self.max_concurrent)
+        self.lock = threading.Lock()
+    
+    def client_id(self, remote_addr, forwarded_for):
+        """Client address, taken from X-Forwarded-For only as far as trusted proxies vouch for it"""
+        if self.trusted_proxies and forwarded_for:
+            hops = [hop.strip() for hop in forwarded_for.split(',') if hop.strip()]
+            if hops:
+                return hops[-min(self.trusted_proxies, len(hops))]
+        return remote_addr or 'unknown'
+    
+    def check_rate(self, client, route):
+        """Seconds the client must wait, or 0; and whether the route itself is over its rate
+        
+        The client's token is handed back when the route is over its rate, so
+        requests shed for server load don't use up the client's allowance.
+        """
+        now = time.monotonic()
+        with self.lock:
+            key = (client, route)
+            bucket = self.client_buckets.get(key)
+            if bucket is None:
+                if len(self.client_buckets) >= self.max_clients:
+                    self.prune(now)
+                bucket = self.client_buckets[key] = TokenBucket(self.client_rate, self.client_burst)
+            
+            client_wait = bucket.take(now)
+            if client_wait:
+                return client_wait, False
+            if self.route_buckets[route].take(now):
+                bucket.refund()
+                return 0, True
+            return 0, False
+    
+    def refund(self, client, route):
+        """Return a client token taken by check_rate when no slot came free"""
+        with self.lock:
+            bucket = self.client_buckets.get((client, route))
+            if bucket is not None:
+                bucket.refund()
+    
+    def prune(self, now):
+        """Drop buckets that have refilled, since they behave like new ones"""
+        for key, bucket in list(self.client_buckets.items()):
+            if bucket.tokens + (now - bucket.updated) * bucket.rate >= bucket.burst:
+                del self.client_buckets[key]
+    
+    def acquire_slot(self, timeout=None):
+        return self.slots.acquire(timeout=self.queue_timeout if timeout is None else timeout)
+    
+    def try_acquire_slot(self):
+        return self.slots.acquire(blocking=False)
+    
+    def release_slot(self):
+        self.slots.release()
+    
+    def fallback(self, route, view_args, cache_key):
+        """A cheap answer for an overloaded route: (cache entry, None) or (None, snapshot payload)"""
+        entry = response_cache.peek(cache_key)
+        if entry is not None:
+            return entry, None
+        if route == '/get_enhanced_predictions/<river_name>':
+            snapshot_entry = fleet_refresher.river_entry(view_args.get('river_name'))
+            if snapshot_entry is not None:
+                return None, snapshot_entry
+        return None, None
+    
+    def retry_after(self, seconds):
+        return str(max(1, math.ceil(seconds)))
+    
+    def claim_slot(self, client, route, acquired):
+        """Record the outcome of waiting for a slot; the client's token is refunded if none came free"""
+        if acquired:
+            ADMISSION_DECISIONS.labels(route, 'admitted').inc()
+            return True
+        self.refund(client, route)
+        return False
+    
+    def overload_response(self, route, view_args, cache_key, client_wait, dumps,
+                          if_none_match=None, accept_encoding=None):
+        """Status, headers and body for a request that was not admitted
+        
+        Shared by the Flask and ASGI paths: an answer already computed when
+        there is one, otherwise a 429 with Retry-After. dumps serializes JSON
+        payloads the way the app does.
+        """
+        # Over a client or server limit: prefer something already computed over rejecting
+        entry, snapshot_entry = self.fallback(route, view_args, cache_key)
+        if entry is not None:
+            ADMISSION_DECISIONS.labels(route, 'fallback').inc()
+            status, headers, body = response_cache.render(entry, True, if_none_match, accept_encoding)
+            return status, headers + [('X-Served-From', 'cache')], body
+        
+        if snapshot_entry is not None:
+            ADMISSION_DECISIONS.labels(route, 'fallback').inc()
+            status, payload, headers = 200, snapshot_entry, [('X-Served-From', 'snapshot')]
+        elif client_wait:
+            ADMISSION_DECISIONS.labels(route, 'rate_limited').inc()
+            status, payload = 429, {'error': 'Too many requests from this client'}
+            headers = [('Retry-After', self.retry_after(client_wait))]
+        else:
+            ADMISSION_DECISIONS.labels(route, 'shed').inc()
+            status, payload = 429, {'error': 'Server is busy, please retry shortly'}
+            headers = [('Retry-After', self.retry_after(1.0 / self.routes[route][0]))]
+        return status, [('Content-Type', 'application/json'), *headers], (dumps(payload) + '\n').encode()
+    
+    def before_request(self):
+        """Flask hook: rate limit, then admit, fall back or shed expensive requests"""
+        route = request.url_rule.rule if request.url_rule is not None else None
+        if not self.enabled or route not in self.routes:
+            return None
+        
+        client = self.client_id(request.remote_addr, request.headers.get('X-Forwarded-For'))
+        client_wait, route_overloaded = self.check_rate(client, route)
+        if not client_wait and not route_overloaded and self.claim_slot(client, route, self.acquire_slot()):
+            g.admission_slot = True
+            return None
+        
+        cache_key = (request.path, tuple(sorted(request.args.items(multi=True))))
+        status, headers, body = self.overload_response(route, request.view_args or {}, cache_key, client_wait,
+                                                       current_app.json.dumps, request.headers.get('If-None-Match'),
+                                                       request.headers.get('Accept-Encoding'))
+        return Response(body, status=status, headers=headers)
+    
+    def teardown_request(self):
+        if g.pop('admission_slot', False):
+            self.release_slot()
+
+def init_app(app):
+    """Apply admission control to the expensive routes"""
+    
+    @app.before_request
+    def admit_request():
+        return admission_controller.before_request()
+    
+    @app.teardown_request
+    def release_admission(exc):
+        admission_controller.teardown_request()
+
+# Global admission controller instance
+admission_controller = AdmissionController()
@@ -0,0 +1,198 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import requests
+import numpy as np
+
+class AlertDispatcher:
+    def __init__(self, targets=None, alert_levels=('high', 'critical'), dedup_window=1800,
+                 batch_size=20, batch_linger=2.0, max_workers=4, max_retries=3,
+                 backoff_base=0.5, timeout=5):
+        # Webhook URLs, comma separated in ALERT_WEBHOOK_URLS when not passed in
+        if targets is None:
+            targets = [url.strip() for url in os.environ.get('ALERT_WEBHOOK_URLS', '').split(',') if url.strip()]
+        self.targets = list(targets)
+        self.alert_levels = set(alert_levels)
+        self.dedup_window = dedup_window  # Seconds before the same river/level alerts again
+        self.batch_size = batch_size
+        self.batch_linger = batch_linger  # Seconds to wait for a batch to fill
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.timeout = timeout
+        
+        self.queue = queue.Queue()
+        self.last_sent = {}  # (river_name, level) -> time of last accepted alert
+        self.lock = threading.Lock()
+        self.worker = None
+        self.executor = None
+        self.backlog = 0  # Alerts accepted but not yet handed to the pool
+        self.pending = 0  # Deliveries handed to the pool but not finished
+        
+        self.stats = {
+            'submitted': 0,
+            'deduplicated': 0,
+            'batches': 0,
+            'delivered': 0,
+            'retries': 0,
+            'failed': 0
+        }
+        # Per webhook alert counts; the totals above count each alert once however many targets it went to
+        self.target_stats = {target: {'delivered': 0, 'failed': 0} for target in self.targets}
+        self.latencies = deque(maxlen=1000)  # Seconds from submit to first delivery
+    
+    def start(self):
+        """Start the batching thread and delivery pool on first use"""
+        with self.lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='alert-delivery')
+                self.worker = threading.Thread(target=self.run, name='alert-dispatcher', daemon=True)
+                self.worker.start()
+    
+    def submit(self, river_name, level, source, details=None):
+        """Queue an alert if the level warrants one and it is not a recent duplicate"""
+        if level not in self.alert_levels or not self.targets:
+            return False
+        
+        now = time.time()
+        key = (river_name, level)
+        with self.lock:
+            last = self.last_sent.get(key)
+            if last is not None and now - last < self.dedup_window:
+                self.stats['deduplicated'] += 1
+                return False
+            self.last_sent[key] = now
+            self.stats['submitted'] += 1
+            self.backlog += 1
+        
+        self.start()
+        self.queue.put({
+            'river_name': river_name,
+            'level': level,
+            'source': source,
+            'details': details or {},
+            'timestamp': datetime.now().isoformat(),
+            'submitted_at': now
+        })
+        return True
+    
+    def submit_predictions(self, river_name, predictions):
+        """Queue an alert for each timeframe whose prediction reaches an alerting risk level"""
+        for timeframe, prediction in predictions.items():
+            if prediction.get('risk_level'):
+                self.submit(river_name, prediction['risk_level'], 'prediction', {
+                    'timeframe': timeframe,
+                    'prediction': prediction['prediction'],
+                    'confidence': prediction['confidence']
+                })
+    
+    def run(self):
+        """Collect queued alerts into batches and hand them to the delivery pool"""
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + self.batch_linger
+            
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            with self.lock:
+                self.stats['batches'] += 1
+                self.backlog -= len(batch)
+                self.pending += len(self.targets)
+            
+            outcome = {'remaining': len(self.targets), 'delivered': False}
+            for target in self.targets:
+                self.executor.submit(self.deliver, target, batch, outcome)
+    
+    def deliver(self, target, batch, outcome):
+        """POST one batch to one webhook, retrying with exponential backoff"""
+        payload = {
+            'alerts': [{k: v for k, v in alert.items() if k != 'submitted_at'} for alert in batch]
+        }
+        
+        delivered = False
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response = requests.post(target, json=payload, timeout=self.timeout)
+                    if response.status_code < 400:
+                        delivered = True
+                        return True
+                    # Client errors other than rate limiting will not succeed on retry
+                    if response.status_code < 500 and response.status_code != 429:
+                        break
+                except requests.exceptions.RequestException:
+                    pass
+                
+                if attempt < self.max_retries:
+                    with self.lock:
+                        self.stats['retries'] += 1
+                    time.sleep(self.backoff_base * (2 ** attempt))
+            
+            return False
+        finally:
+            self.record_delivery(target, batch, outcome, delivered)
+    
+    def record_delivery(self, target, batch, outcome, delivered):
+        """Count one target's result; a batch counts as delivered once any target took it"""
+        delivered_at = time.time()
+        with self.lock:
+            self.target_stats[target]['delivered' if delivered else 'failed'] += len(batch)
+            if delivered and not outcome['delivered']:
+                outcome['delivered'] = True
+                self.stats['delivered'] += len(batch)
+                self.latencies.extend(delivered_at - alert['submitted_at'] for alert in batch)
+            
+            outcome['remaining'] -= 1
+            if outcome['remaining'] == 0 and not outcome['delivered']:
+                self.stats['failed'] += len(batch)
+            self.pending -= 1
+    
+    def flush(self, timeout=30):
+        """Wait until queued alerts have been delivered or given up on"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self.lock:
+                idle = self.backlog == 0 and self.pending == 0
+            if idle:
+                return True
+            time.sleep(0.05)
+        return False
+    
+    def get_metrics(self):
+        """Delivery latency and backlog figures for monitoring"""
+        with self.lock:
+            latencies = np.array(self.latencies)
+            metrics = {
+                **self.stats,
+                'backlog': self.backlog,
+                'in_flight': self.pending,
+                'targets': len(self.targets),
+                'per_target': {target: dict(counts) for target, counts in self.target_stats.items()},
+                'dedup_window_seconds': self.dedup_window
+            }
+        
+        if len(latencies):
+            p50, p95 = np.percentile(latencies, [50, 95])
+            metrics['latency_seconds'] = {
+                'p50': round(float(p50), 3),
+                'p95': round(float(p95), 3),
+                'max': round(float(latencies.max()), 3)
+            }
+        else:
+            metrics['latency_seconds'] = None
+        
+        return metrics
+
+# Global alert dispatcher instance
+alert_dispatcher = AlertDispatcher()
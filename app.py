@@ -1,22 +1,40 @@
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, Response, request, jsonify, render_template, send_from_directory, send_file
 from flask_cors import CORS
-import pandas as pd
 import numpy as np
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.preprocessing import StandardScaler
 import joblib
 import os
+import json
+import base64
+import bisect
 from datetime import datetime, timedelta
 import threading
 import time
+import multiprocessing
 
 # Import our custom systems
 from sensor_system import sensor_system
 from weather_system import weather_system
 from enhanced_ai import enhanced_ai
+from warning_rules import warning_engine, build_fleet_matrices
+from alert_system import alert_dispatcher
+from site_registry import site_registry
+from image_variants import image_variants
+from response_cache import response_cache
+from tide_system import tide_engine
+from fleet_refresh import fleet_refresher
+from tile_system import tile_renderer
+import metrics
+import profiling
+import admission_control
+from profiling import stage
 
 app = Flask(__name__)
 CORS(app)
+metrics.init_app(app)
+profiling.init_app(app)
+admission_control.init_app(app)
 
 # Load or create models
 def load_or_create_models():
@@ -66,10 +84,42 @@ debris_predictor, scaler = load_or_create_models()
 # Set up enhanced AI with our models
 enhanced_ai.set_models(debris_predictor, scaler)
 
+# Let nearby weather queries share the cached forecast of the closest site
+weather_system.set_site_index(site_registry)
+
 # Global variables for scheduled updates
 last_sensor_update = datetime.now()
 last_weather_update = datetime.now()
 next_update_time = datetime.now() + timedelta(hours=2)  # Update every 2 hours
+SENSOR_UPDATE_INTERVAL = 5 * 60  # Sensor readings are refreshed every 5 minutes
+
+def publish_fleet_snapshot(snapshot):
+    """Record a fleet refresh in the update schedule and alert on risky predictions"""
+    global last_sensor_update, last_weather_update, next_update_time
+    last_sensor_update = last_weather_update = datetime.fromisoformat(snapshot['completed'])
+    next_update_time = last_sensor_update + timedelta(hours=2)
+    
+    for river_name, entry in snapshot['rivers'].items():
+        if entry.get('stale'):
+            continue
+        alert_dispatcher.submit_predictions(river_name, entry['predictions'])
+
+fleet_refresher.on_publish.append(publish_fleet_snapshot)
+# Re-render the cached debris tiles around sites whose prediction changed
+fleet_refresher.on_publish.append(lambda snapshot: tile_renderer.enabled and tile_renderer.request_sync('debris'))
+
+# Optional background refresh of every site (seconds between refreshes, 0 = only on request)
+FLEET_REFRESH_INTERVAL = float(os.environ.get('FLEET_REFRESH_INTERVAL', 0))
+# Inference workers are spawned and re-import this module when it is run as a script
+if FLEET_REFRESH_INTERVAL > 0 and multiprocessing.parent_process() is None:
+    fleet_refresher.start_interval(FLEET_REFRESH_INTERVAL)
+
+def river_data_version(river_name):
+    """Version of the catalog and cached weather behind a per-river response"""
+    site = site_registry.find(river_name)
+    if site is None:
+        return (site_registry.version, None)
+    return (site_registry.version, weather_system.cache_version(site['lat'], site['lng']))
 
 # Serve the login page as default
 @app.route('/')
@@ -98,57 +148,105 @@ def test_images():
         'sungaiInanam_exists': 'sungaiInanam.png' in files
     })
 
-# Serve images from data folder
+# Serve images from data folder, resized with ?w= (and optionally &format=webp|jpeg)
 @app.route('/data/image/<path:filename>')
 def serve_images(filename):
-    print(f"🔍 Requesting image: {filename}")
-    print(f"📁 Looking in: data/image/")
     try:
-        return send_from_directory('data/image', filename)
+        width = request.args.get('w', type=int)
+        fmt = request.args.get('format')
+        
+        if image_variants.enabled and (width or fmt):
+            fmt = image_variants.choose_format(fmt, request.headers.get('Accept'))
+            variant = image_variants.get_variant(filename, width or 1280, fmt)
+            if variant is None:
+                return f"Image not found: {filename}", 404
+            
+            path, mimetype, etag = variant
+            response = send_file(path, mimetype=mimetype, etag=etag, conditional=True,
+                                 max_age=image_variants.max_age)
+            response.vary.add('Accept')
+            return response
+        
+        original = image_variants.original(filename)
+        if original is None:
+            return f"Image not found: {filename}", 404
+        
+        path, etag = original
+        return send_file(path, etag=etag, conditional=True, max_age=image_variants.max_age)
     except Exception as e:
-        print(f"❌ Error serving image {filename}: {e}")
-        return f"Image not found: {filename}", 404
+        return f"Image not available: {filename} ({e})", 500
+
+@app.route('/tiles/<layer>/<int:z>/<int:x>/<int:y>.png')
+def serve_tile(layer, z, x, y):
+    """Interpolated pollution or debris surface as a 256px web mercator tile"""
+    try:
+        if not tile_renderer.enabled:
+            return jsonify({'error': 'Tile rendering is not available'}), 503
+        
+        tile = tile_renderer.get_tile(layer, z, x, y)
+        if tile is None:
+            return jsonify({'error': 'Tile not found'}), 404
+        
+        path, etag = tile
+        return send_file(path, mimetype='image/png', etag=etag, conditional=True, max_age=tile_renderer.max_age)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Readings per /predict_debris batch; tree arrays grow with trees x readings
+MAX_PREDICT_BATCH = int(os.environ.get('MAX_PREDICT_BATCH', 1000))
 
 @app.route('/predict_debris', methods=['POST'])
 def predict_debris():
     try:
         data = request.json
         
+        # Accept a single reading or a batch under 'readings'
+        readings = data['readings'] if 'readings' in data else [data]
+        if len(readings) > MAX_PREDICT_BATCH:
+            return jsonify({'error': f'Batch too large: at most {MAX_PREDICT_BATCH} readings per request'}), 400
+        
         # Extract features
-        features = np.array([
-            data.get('rainfall', 0),
-            data.get('wind_speed', 0),
-            data.get('tide_level', 0),
-            data.get('water_flow_rate', 0)
-        ]).reshape(1, -1)
-        
-        # Scale features
-        features_scaled = scaler.transform(features)
-        
-        # Make prediction
-        prediction = debris_predictor.predict(features_scaled)[0]
-        
-        # Calculate risk level
-        if prediction > 250:
-            risk_level = 'high'
-        elif prediction > 150:
-            risk_level = 'medium'
-        else:
-            risk_level = 'low'
+        features = np.array([[
+            reading.get('rainfall', 0),
+            reading.get('wind_speed', 0),
+            reading.get('tide_level', 0),
+            reading.get('water_flow_rate', 0)
+        ] for reading in readings]).reshape(-1, 4)
+        
+        # Make predictions with per-tree uncertainty
+        uncertainty = enhanced_ai.predict_with_uncertainty(features)
+        confidence = enhanced_ai.calculate_model_confidence(
+            uncertainty['mean'], uncertainty['lower'], uncertainty['upper'])
+        
+        results = []
+        for i, prediction in enumerate(uncertainty['mean']):
+            # Calculate risk level
+            if prediction > 250:
+                risk_level = 'high'
+            elif prediction > 150:
+                risk_level = 'medium'
+            else:
+                risk_level = 'low'
+            
+            results.append({
+                'prediction': round(float(prediction), 1),
+                'risk_level': risk_level,
+                'confidence': round(float(confidence[i]), 2),
+                **enhanced_ai.format_uncertainty(uncertainty, i)
+            })
         
-        return jsonify({
-            'prediction': round(prediction, 1),
-            'risk_level': risk_level,
-            'confidence': 0.85
-        })
+        if 'readings' in data:
+            return jsonify({'predictions': results})
+        return jsonify(results[0])
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
 @app.route('/detect_hotspots', methods=['GET'])
+@response_cache.cached(version=lambda: site_registry.current_version())
 def detect_hotspots():
     try:
         # Read current data
-        df = pd.read_csv('data/data.csv')
+        df = site_registry.catalog()
         
         # Identify hotspots based on pollution level
         hotspots = []
@@ -171,61 +269,199 @@ def early_warning():
     try:
         data = request.json
         
-        # Check warning conditions
-        rainfall = data.get('rainfall', 0)
-        wind_speed = data.get('wind_speed', 0)
-        tide_level = data.get('tide_level', 0)
-        
-        # Simple warning logic
-        warning_score = 0
-        if rainfall > 30:
-            warning_score += 2
-        if wind_speed > 20:
-            warning_score += 1
-        if tide_level > 2:
-            warning_score += 1
-        
-        if warning_score >= 3:
-            warning_level = 'high'
-        elif warning_score >= 2:
-            warning_level = 'medium'
-        else:
-            warning_level = 'low'
+        # Check warning conditions against the configured rules
+        result = warning_engine.evaluate_reading(data)
+        warning_level = result['warning_level']
         
         return jsonify({
             'warning_level': warning_level,
-            'warning_score': warning_score,
+            'warning_score': result['warning_score'],
+            'triggered_rules': result['triggered_rules'],
             'message': f'Debris risk level: {warning_level}'
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+@app.route('/early_warning/fleet', methods=['GET', 'POST'])
+def early_warning_fleet():
+    """Evaluate warning rules for every river over the forecast horizon
+    
+    GET is read-only; POST also publishes the current levels as the new
+    baseline and alerts on the transitions.
+    """
+    try:
+        hours = int(request.args.get('hours', 24))
+        commit = request.method == 'POST'
+        
+        sensor_data = sensor_system.get_all_sensor_data()
+        with stage('weather'):
+            weather_reports = weather_system.get_weather_for_rivers({
+                river_name: river_data['coordinates'] for river_name, river_data in sensor_data.items()
+            })
+        
+        sites, fields, times = build_fleet_matrices(sensor_data, weather_reports, hours, warning_engine.step_hours)
+        result = warning_engine.evaluate_fleet(sites, fields, times, commit=commit)
+        
+        # Notify on escalations when publishing; the dispatcher drops repeats within its window
+        if commit:
+            for transition in result['transitions']:
+                alert_dispatcher.submit(transition['site'], transition['to'], 'early_warning', transition)
+        
+        return jsonify({
+            'timestamp': datetime.now().isoformat(),
+            'horizon_hours': hours,
+            'committed': commit,
+            'rivers': result['sites'],
+            'transitions': result['transitions']
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+# Location field -> catalog column
+LOCATION_FIELDS = {
+    'id': 'id',
+    'lat': 'latitude',
+    'lng': 'longitude',
+    'name': 'name',
+    'pollution_level': 'pollution_level',
+    'image': 'image',
+    'rainfall': 'rainfall',
+    'wind_speed': 'wind_speed',
+    'tide_level': 'tide_level',
+    'water_flow_rate': 'water_flow_rate'
+}
+
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(json.dumps({'after': last_id}).encode()).decode()
+
+def decode_cursor(cursor):
+    return json.loads(base64.urlsafe_b64decode(cursor.encode()))['after']
+
+def generate_locations(columns, fields, start, end):
+    """Yield one location dict at a time from the column lists"""
+    selected = [(field, columns[LOCATION_FIELDS[field]]) for field in fields]
+    for i in range(start, end):
+        yield {field: values[i] for field, values in selected}
+
 @app.route('/get_all_locations', methods=['GET'])
+@response_cache.cached(version=lambda: site_registry.current_version())
 def get_all_locations():
+    """All locations, optionally paged (?limit=&cursor=), projected (?fields=) and streamed (?format=ndjson|stream=1)"""
     try:
-        df = pd.read_csv('data/data.csv')
-        locations = []
+        columns = site_registry.catalog_columns()
+        ids = columns['id']
+        
+        fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()] or list(LOCATION_FIELDS)
+        unknown = [f for f in fields if f not in LOCATION_FIELDS]
+        if unknown:
+            return jsonify({'error': f"Unknown fields: {', '.join(unknown)}"}), 400
+        
+        # Cursor pagination resumes after the last id sent, ids are sorted
+        start = 0
+        if 'cursor' in request.args:
+            start = bisect.bisect_right(ids, decode_cursor(request.args['cursor']))
+        limit = request.args.get('limit', type=int)
+        end = len(ids) if limit is None else min(len(ids), start + max(limit, 1))
+        next_cursor = encode_cursor(ids[end - 1]) if end < len(ids) else None
+        
+        rows = generate_locations(columns, fields, start, end)
+        
+        if request.args.get('format') == 'ndjson':
+            def ndjson():
+                for row in rows:
+                    yield json.dumps(row, separators=(',', ':')) + '\n'
+            response = Response(ndjson(), mimetype='application/x-ndjson')
+            if next_cursor:
+                response.headers['X-Next-Cursor'] = next_cursor
+            return response
+        
+        if request.args.get('stream', 'false').lower() in ('1', 'true', 'yes'):
+            def chunked_json():
+                yield '{"locations":['
+                for i, row in enumerate(rows):
+                    yield (',' if i else '') + json.dumps(row, separators=(',', ':'))
+                yield '],"next_cursor":' + json.dumps(next_cursor) + '}'
+            return Response(chunked_json(), mimetype='application/json')
+        
+        result = {'locations': list(rows)}
+        if limit is not None or 'cursor' in request.args:
+            result['next_cursor'] = next_cursor
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/nearest_rivers', methods=['GET'])
+def nearest_rivers():
+    """Find the rivers nearest to a point, or all within radius_km"""
+    try:
+        lat = float(request.args['lat'])
+        lng = float(request.args['lng'])
         
-        for _, row in df.iterrows():
-            locations.append({
-                'id': row['id'],
-                'lat': row['latitude'],
-                'lng': row['longitude'],
-                'name': row['name'],
-                'pollution_level': row['pollution_level'],
-                'image': row['image'],
-                'rainfall': row['rainfall'],
-                'wind_speed': row['wind_speed'],
-                'tide_level': row['tide_level'],
-                'water_flow_rate': row['water_flow_rate']
-            })
+        if 'radius_km' in request.args:
+            rivers = site_registry.within_radius(lat, lng, float(request.args['radius_km']))
+        else:
+            rivers = site_registry.nearest(lat, lng, int(request.args.get('k', 1)))
         
-        return jsonify({'locations': locations})
+        return jsonify({'lat': lat, 'lng': lng, 'rivers': rivers})
+    except KeyError as e:
+        return jsonify({'error': f'Missing parameter: {e.args[0]}'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+MAX_TIDE_POINTS = 20000  # Caps one /tide response (e.g. 4 months at 10 minutes)
+MAX_TIDE_DAYS = 31  # Caps the range high/low waters and the summary are computed over
+
+def parse_time(value, default):
+    """Epoch seconds from an ISO 8601 string or a number of seconds"""
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+@app.route('/tide/<river_name>', methods=['GET'])
+def get_tide(river_name):
+    """Predicted tide levels and high/low waters for a river over a time range"""
+    try:
+        if not tide_engine.has_station(river_name):
+            return jsonify({'error': 'No tide station for river'}), 404
+        
+        start = parse_time(request.args.get('from'), time.time())
+        end = parse_time(request.args.get('to'), start + 24 * 3600)
+        step_minutes = float(request.args.get('step', 10))
+        
+        if end <= start or step_minutes <= 0:
+            return jsonify({'error': 'Expected from < to and a positive step'}), 400
+        if end - start > MAX_TIDE_DAYS * 86400:
+            return jsonify({'error': f'Range too large: at most {MAX_TIDE_DAYS} days per request'}), 400
+        if (end - start) / (step_minutes * 60) > MAX_TIDE_POINTS:
+            return jsonify({'error': f'Range too large: at most {MAX_TIDE_POINTS} points per request'}), 400
+        
+        epochs, levels = tide_engine.levels(river_name, start, end, step_minutes * 60)
+        extremes = tide_engine.extremes(river_name, start, end)
+        extreme_epochs, extreme_levels, is_high = extremes
+        
+        return jsonify({
+            'river_name': river_name,
+            'from': datetime.fromtimestamp(start).isoformat(),
+            'to': datetime.fromtimestamp(end).isoformat(),
+            'step_minutes': step_minutes,
+            'times': [datetime.fromtimestamp(epoch).isoformat() for epoch in epochs],
+            'levels': np.round(levels, 3).tolist(),
+            'high_low': [{
+                'time': datetime.fromtimestamp(epoch).isoformat(),
+                'level': round(float(level), 3),
+                'type': 'high' if high else 'low'
+            } for epoch, level, high in zip(extreme_epochs, extreme_levels, is_high)],
+            'summary': tide_engine.summary(river_name, start, end, extremes)
+        })
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
 # New enhanced endpoints
 @app.route('/get_sensor_data/<river_name>', methods=['GET'])
+@response_cache.cached(ttl=SENSOR_UPDATE_INTERVAL)
 def get_sensor_data(river_name):
     """Get real-time sensor data for a specific river"""
     try:
@@ -238,44 +474,57 @@ def get_sensor_data(river_name):
         return jsonify({'error': str(e)}), 400
 
 @app.route('/get_weather_data/<river_name>', methods=['GET'])
+@response_cache.cached(version=river_data_version, ttl=weather_system.cache_duration)
 def get_weather_data(river_name):
     """Get weather data for a specific river"""
     try:
-        # Get coordinates from CSV
-        df = pd.read_csv('data/data.csv')
-        river_data = df[df['name'].str.contains(river_name, case=False, na=False)]
+        # Get coordinates from the site registry
+        site = site_registry.find(river_name)
         
-        if river_data.empty:
+        if site is None:
             return jsonify({'error': 'River not found'}), 404
         
-        lat = river_data.iloc[0]['latitude']
-        lng = river_data.iloc[0]['longitude']
+        lat = site['lat']
+        lng = site['lng']
         
-        weather_data = weather_system.get_weather_for_river(river_name, (lat, lng))
+        include_hourly = request.args.get('hourly', 'false').lower() in ('1', 'true', 'yes')
+        weather_data = weather_system.get_weather_for_river(river_name, (lat, lng), include_hourly)
+        if 'error' in weather_data:
+            response_cache.bypass()
         return jsonify(weather_data)
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
 @app.route('/get_enhanced_predictions/<river_name>', methods=['GET'])
+@response_cache.cached(version=river_data_version, ttl=SENSOR_UPDATE_INTERVAL)
 def get_enhanced_predictions(river_name):
     """Get enhanced AI predictions for multiple timeframes"""
     try:
         # Get sensor data
-        sensor_data = sensor_system.get_sensor_data_for_river(river_name)
+        with stage('sensors'):
+            sensor_data = sensor_system.get_sensor_data_for_river(river_name)
         
         # Get weather data
-        df = pd.read_csv('data/data.csv')
-        river_data = df[df['name'].str.contains(river_name, case=False, na=False)]
+        with stage('site_lookup'):
+            site = site_registry.find(river_name)
         
-        if river_data.empty:
+        if site is None:
             return jsonify({'error': 'River not found'}), 404
         
-        lat = river_data.iloc[0]['latitude']
-        lng = river_data.iloc[0]['longitude']
-        weather_data = weather_system.get_weather_for_river(river_name, (lat, lng))
+        lat = site['lat']
+        lng = site['lng']
+        include_hourly = request.args.get('hourly', 'false').lower() in ('1', 'true', 'yes')
+        with stage('weather'):
+            weather_data = weather_system.get_weather_for_river(river_name, (lat, lng), include_hourly)
+        if 'error' in weather_data:
+            response_cache.bypass()
         
         # Get predictions for multiple timeframes
-        predictions = enhanced_ai.get_multiple_predictions(sensor_data, weather_data)
+        with stage('predict'):
+            predictions = enhanced_ai.get_multiple_predictions(sensor_data, weather_data)
+        
+        # Notify when any timeframe reaches an alerting risk level
+        alert_dispatcher.submit_predictions(river_name, predictions)
         
         return jsonify({
             'river_name': river_name,
@@ -288,6 +537,7 @@ def get_enhanced_predictions(river_name):
         return jsonify({'error': str(e)}), 400
 
 @app.route('/get_update_schedule', methods=['GET'])
+@response_cache.cached(version=lambda: (last_sensor_update, last_weather_update, next_update_time))
 def get_update_schedule():
     """Get information about scheduled updates"""
     global last_sensor_update, last_weather_update, next_update_time
@@ -297,9 +547,41 @@ def get_update_schedule():
         'last_weather_update': last_weather_update.isoformat(),
         'next_update': next_update_time.isoformat(),
         'update_interval_hours': 2,
-        'sensor_update_interval_minutes': 5
+        'sensor_update_interval_minutes': SENSOR_UPDATE_INTERVAL // 60
     })
 
+@app.route('/fleet_snapshot', methods=['GET'])
+@response_cache.cached(version=lambda: fleet_refresher.version)
+def get_fleet_snapshot():
+    """Latest full-fleet refresh: predictions, sensor and weather data per site"""
+    version, snapshot = fleet_refresher.current()
+    if snapshot is None:
+        return jsonify({'error': 'No fleet snapshot yet', 'refreshing': fleet_refresher.running}), 404
+    response_cache.set_version(version)
+    return jsonify(snapshot)
+
+@app.route('/refresh_fleet', methods=['POST'])
+def refresh_fleet():
+    """Refresh every site now; ?wait=1 blocks until the snapshot is published"""
+    try:
+        if request.args.get('wait', 'false').lower() in ('1', 'true', 'yes'):
+            snapshot = fleet_refresher.refresh()
+            return jsonify({key: value for key, value in snapshot.items() if key != 'rivers'})
+        
+        started = fleet_refresher.refresh_async()
+        return jsonify({
+            'started': started,
+            'refreshing': True,
+            'version': fleet_refresher.version
+        }), 202
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/alert_status', methods=['GET'])
+def get_alert_status():
+    """Get alert delivery latency and backlog metrics"""
+    return jsonify(alert_dispatcher.get_metrics())
+
 @app.route('/get_weather_api_status', methods=['GET'])
 def get_weather_api_status():
     """Get weather API configuration status"""
@@ -326,15 +608,14 @@ def test_sensors():
 def test_weather(river_name):
     """Test endpoint to see what weather data is being returned"""
     try:
-        # Get coordinates from CSV
-        df = pd.read_csv('data/data.csv')
-        river_data = df[df['name'].str.contains(river_name, case=False, na=False)]
+        # Get coordinates from the site registry
+        site = site_registry.find(river_name)
         
-        if river_data.empty:
+        if site is None:
             return jsonify({'error': 'River not found'}), 404
         
-        lat = river_data.iloc[0]['latitude']
-        lng = river_data.iloc[0]['longitude']
+        lat = site['lat']
+        lng = site['lng']
         
         # Test current weather
         current_weather = weather_system.get_current_weather(lat, lng)
@@ -0,0 +1,276 @@
+"""ASGI entry point for the async serving mode.
+
+Weather-bound routes run on the event loop: upstream calls are awaited on a
+shared async client, and forest inference is handed to a thread pool. Every
+other route is served by the Flask app on its own worker threads.
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port $PORT
+    gunicorn asgi_app:app -k uvicorn.workers.UvicornWorker -c gunicorn.conf.py
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qsl
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.wsgi import WsgiToAsgi
+
+from app import app as flask_app, river_data_version, SENSOR_UPDATE_INTERVAL
+from async_weather import async_weather_system
+from sensor_system import sensor_system
+from weather_system import weather_system
+from enhanced_ai import enhanced_ai
+from alert_system import alert_dispatcher
+from site_registry import site_registry
+from response_cache import response_cache
+from metrics import REQUEST_COUNT, REQUEST_LATENCY, REQUESTS_IN_FLIGHT
+from profiling import current_timings, request_profiler, server_timing, stage
+from admission_control import admission_controller
+
+# CPU-bound work (inference) runs here so it never blocks the event loop
+predict_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('ASGI_PREDICT_THREADS', os.cpu_count() or 4)),
+                                      thread_name_prefix='predict')
+# Flask routes; asgiref would otherwise run every WSGI call on one shared thread
+wsgi_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('ASGI_WSGI_THREADS', 16)),
+                                   thread_name_prefix='wsgi')
+
+flask_asgi = WsgiToAsgi(flask_app)
+
+async def wsgi_app(scope, receive, send):
+    """Serve a request with the Flask app on a wsgi_executor thread"""
+    # Under async_to_sync the calling pool thread is where asgiref runs the thread-sensitive WSGI call
+    handler = sync_to_async(async_to_sync(flask_asgi), thread_sensitive=False, executor=wsgi_executor)
+    await handler(scope, receive, send)
+
+class AsyncRequest:
+    """The parts of an ASGI request the async routes read"""
+    
+    def __init__(self, scope):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = parse_qsl(scope.get('query_string', b'').decode('latin-1'), keep_blank_values=True)
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                        for name, value in scope.get('headers', [])}
+    
+    def arg(self, name, default=None):
+        for key, value in self.args:
+            if key == name:
+                return value
+        return default
+    
+    def cache_key(self):
+        """Same key the Flask response cache uses, so both modes share entries"""
+        return (self.path, tuple(sorted(self.args)))
+
+def run_in_executor(func, *args):
+    """Run func on the predict pool, keeping the request's stage timings"""
+    context = contextvars.copy_context()
+    return asyncio.get_running_loop().run_in_executor(predict_executor, functools.partial(context.run, func, *args))
+
+def include_hourly(request):
+    return request.arg('hourly', 'false').lower() in ('1', 'true', 'yes')
+
+async def get_weather_data(request, river_name):
+    """Get weather data for a specific river"""
+    try:
+        # Get coordinates from the site registry
+        site = site_registry.find(river_name)
+        
+        if site is None:
+            return {'error': 'River not found'}, 404, False
+        
+        weather_data = await async_weather_system.get_weather_for_river(
+            river_name, (site['lat'], site['lng']), include_hourly(request))
+        return weather_data, 200, 'error' not in weather_data
+    except Exception as e:
+        return {'error': str(e)}, 400, False
+
+async def get_enhanced_predictions(request, river_name):
+    """Get enhanced AI predictions for multiple timeframes"""
+    try:
+        # Get sensor data
+        with stage('sensors'):
+            sensor_data = sensor_system.get_sensor_data_for_river(river_name)
+        
+        # Get weather data
+        with stage('site_lookup'):
+            site = site_registry.find(river_name)
+        
+        if site is None:
+            return {'error': 'River not found'}, 404, False
+        
+        with stage('weather'):
+            weather_data = await async_weather_system.get_weather_for_river(
+                river_name, (site['lat'], site['lng']), include_hourly(request))
+        
+        # Get predictions for multiple timeframes
+        with stage('predict'):
+            predictions = await run_in_executor(enhanced_ai.get_multiple_predictions, sensor_data, weather_data)
+        
+        # Notify when any timeframe reaches an alerting risk level
+        alert_dispatcher.submit_predictions(river_name, predictions)
+        
+        return {
+            'river_name': river_name,
+            'timestamp': datetime.now().isoformat(),
+            'predictions': predictions,
+            'sensor_data': sensor_data,
+            'weather_data': weather_data
+        }, 200, 'error' not in weather_data
+    except Exception as e:
+        return {'error': str(e)}, 400, False
+
+async def test_weather(request, river_name):
+    """Test endpoint to see what weather data is being returned"""
+    try:
+        # Get coordinates from the site registry
+        site = site_registry.find(river_name)
+        
+        if site is None:
+            return {'error': 'River not found'}, 404, False
+        
+        lat = site['lat']
+        lng = site['lng']
+        
+        current_weather, forecast_weather, processed_weather = await asyncio.gather(
+            async_weather_system.get_current_weather(lat, lng),
+            async_weather_system.get_weather_forecast(lat, lng, days=1),
+            async_weather_system.get_weather_for_river(river_name, (lat, lng)))
+        
+        return {
+            'river_name': river_name,
+            'coordinates': (lat, lng),
+            'current_weather_raw': current_weather,
+            'forecast_weather_raw': forecast_weather,
+            'processed_weather': processed_weather,
+            'api_key_status': weather_system.api_key != "YOUR_WEATHER_API_KEY_HERE"
+        }, 200, False
+    except Exception as e:
+        return {
+            'error': str(e),
+            'traceback': str(e.__traceback__)
+        }, 500, False
+
+# (pattern, Flask rule used as the metrics label, view, response cache version, ttl)
+ROUTES = [
+    (re.compile(r'/get_weather_data/([^/]+)'), '/get_weather_data/<river_name>', get_weather_data,
+     river_data_version, lambda: weather_system.cache_duration),
+    (re.compile(r'/get_enhanced_predictions/([^/]+)'), '/get_enhanced_predictions/<river_name>',
+     get_enhanced_predictions, river_data_version, lambda: SENSOR_UPDATE_INTERVAL),
+    (re.compile(r'/test_weather/([^/]+)'), '/test_weather/<river_name>', test_weather, None, None)
+]
+
+def match_route(scope):
+    if scope['type'] != 'http' or scope['method'] != 'GET':
+        return None
+    for pattern, rule, view, version, ttl in ROUTES:
+        match = pattern.fullmatch(scope['path'])
+        if match:
+            return rule, view, version, ttl, match.group(1)
+    return None
+
+async def handle(request, view, version, ttl, river_name):
+    """Run an async view through the shared response cache"""
+    key = request.cache_key()
+    current_version = version(river_name) if version else None
+    
+    if version is not None:
+        entry = response_cache.lookup(key, current_version, ttl())
+        if entry is not None:
+            return response_cache.render(entry, True, request.headers.get('if-none-match'),
+                                             request.headers.get('accept-encoding'))
+    
+    # Views return (payload, status, cacheable); upstream errors are not cacheable
+    payload, status, cacheable = await view(request, river_name)
+    body = (flask_app.json.dumps(payload) + '\n').encode()
+    
+    if version is not None and cacheable:
+        # The view may have fetched the data the version describes, so re-read it
+        entry = response_cache.store(key, body, 'application/json', version(river_name))
+        return response_cache.render(entry, False, request.headers.get('if-none-match'),
+                                     request.headers.get('accept-encoding'))
+    return status, [('Content-Type', 'application/json')], body
+
+async def admit(scope, request, rule, river_name):
+    """Admission control for the async routes: None once a slot is held, else the answer to send"""
+    client = admission_controller.client_id((scope.get('client') or (None,))[0], request.headers.get('x-forwarded-for'))
+    client_wait, route_overloaded = admission_controller.check_rate(client, rule)
+    if not client_wait and not route_overloaded:
+        # Poll for a slot rather than block the event loop on the semaphore
+        deadline = time.monotonic() + admission_controller.queue_timeout
+        acquired = admission_controller.try_acquire_slot()
+        while not acquired and time.monotonic() < deadline:
+            await asyncio.sleep(0.02)
+            acquired = admission_controller.try_acquire_slot()
+        if admission_controller.claim_slot(client, rule, acquired):
+            return None
+    
+    return admission_controller.overload_response(rule, {'river_name': river_name}, request.cache_key(), client_wait,
+                                                  flask_app.json.dumps, request.headers.get('if-none-match'),
+                                                  request.headers.get('accept-encoding'))
+
+async def serve(scope, receive, send, route):
+    rule, view, version, ttl, river_name = route
+    request = AsyncRequest(scope)
+    
+    # Drain the (empty) GET body
+    while (await receive()).get('more_body'):
+        pass
+    
+    token = current_timings.set([])
+    start = time.perf_counter()
+    REQUESTS_IN_FLIGHT.labels(rule).inc()
+    admitted = False
+    try:
+        checked = admission_controller.enabled and rule in admission_controller.routes
+        answer = await admit(scope, request, rule, river_name) if checked else None
+        admitted = checked and answer is None
+        status, headers, body = answer or await handle(request, view, version, ttl, river_name)
+        total_ms = (time.perf_counter() - start) * 1000
+        timings = current_timings.get()
+        
+        headers.append(('Server-Timing', server_timing(timings, total_ms)))
+        headers.append(('Content-Length', str(len(body))))
+        if 'origin' in request.headers:
+            headers.append(('Access-Control-Allow-Origin', '*'))
+        
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]})
+        await send({'type': 'http.response.body', 'body': body})
+        
+        REQUEST_COUNT.labels('GET', rule, status).inc()
+        REQUEST_LATENCY.labels('GET', rule).observe(time.perf_counter() - start)
+        if request_profiler.trace_sample_rate and random.random() < request_profiler.trace_sample_rate:
+            request_profiler.write_trace('GET', rule, request.path, status, total_ms, timings)
+    finally:
+        if admitted:
+            admission_controller.release_slot()
+        REQUESTS_IN_FLIGHT.labels(rule).dec()
+        current_timings.reset(token)
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await async_weather_system.aclose()
+            predict_executor.shutdown(wait=False)
+            wsgi_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    """Async routes on the event loop, everything else through the Flask app"""
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    
+    route = match_route(scope)
+    if route is not None:
+        return await serve(scope, receive, send, route)
+    return await wsgi_app(scope, receive, send)
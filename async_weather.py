@@ -0,0 +1,107 @@
+import asyncio
+import os
+import httpx
+
+from profiling import stage
+from weather_system import weather_system
+
+class AsyncWeatherSystem:
+    """WeatherSystem front end whose API calls await an async HTTP client"""
+    
+    # Cache, API key, site snapping and rate limiting all live on the wrapped
+    # sync instance, so both serving modes read and fill the same data.
+    
+    def __init__(self, weather, max_connections=None, timeout=10):
+        self.weather = weather
+        self.max_connections = max_connections or int(os.environ.get('WEATHER_API_MAX_CONNECTIONS', 20))
+        self.timeout = timeout
+        self.client = None  # Created on first use, inside the serving event loop
+        self.inflight = {}  # cache key -> task, so concurrent misses share one upstream call
+    
+    def get_client(self):
+        """Shared async client with a bounded connection pool"""
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections))
+        return self.client
+    
+    async def aclose(self):
+        """Close the HTTP client (on server shutdown)"""
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+    
+    async def make_api_request(self, endpoint, params):
+        """Make API request with rate limiting and error handling, without blocking a thread"""
+        weather = self.weather
+        if not weather.api_key or weather.api_key == "YOUR_WEATHER_API_KEY_HERE":
+            return {"error": "API key not configured", "instructions": weather.get_api_key_instructions()}
+        
+        client = self.get_client()
+        
+        # Rate limiting, shared with sync callers; calls may overlap in flight
+        wait = weather.reserve_api_slot()
+        if wait:
+            await asyncio.sleep(wait)
+        
+        try:
+            url = f"{weather.base_url}/{endpoint}"
+            params['key'] = weather.api_key
+            
+            with stage('weather_api'):
+                response = await client.get(url, params=params)
+            
+            return weather.handle_api_response(endpoint, response.status_code, response.json)
+        
+        except httpx.HTTPError as e:
+            return weather.handle_api_failure(endpoint, e)
+    
+    async def fetch(self, kind, cache_key, endpoint, params, store):
+        """Cached result, or one upstream call shared by every waiting request"""
+        cached = self.weather.get_cached(kind, cache_key)
+        if cached is not None:
+            return cached
+        
+        task = self.inflight.get(cache_key)
+        if task is None:
+            async def request():
+                try:
+                    return store(cache_key, await self.make_api_request(endpoint, params))
+                finally:
+                    self.inflight.pop(cache_key, None)
+            
+            task = self.inflight[cache_key] = asyncio.ensure_future(request())
+        
+        # Shielded so one client disconnecting does not cancel the call for the others
+        return await asyncio.shield(task)
+    
+    async def get_weather_forecast(self, lat, lng, days=2):
+        """Get weather forecast for a location"""
+        cache_key, params = self.weather.forecast_request(lat, lng, days)
+        return await self.fetch('forecast', cache_key, 'forecast.json', params, self.weather.store_forecast)
+    
+    async def get_extracted_forecast(self, lat, lng, days=2):
+        """Get the forecast already run through extract_forecast_data"""
+        result = await self.get_weather_forecast(lat, lng, days)
+        return self.weather.lookup_extracted(lat, lng, days, result)
+    
+    async def get_current_weather(self, lat, lng):
+        """Get current weather for a location"""
+        cache_key, params = self.weather.current_request(lat, lng)
+        return await self.fetch('current', cache_key, 'current.json', params, self.weather.store_current)
+    
+    async def get_weather_for_river(self, river_name, coordinates, include_hourly=False):
+        """Get weather data for a specific river location, fetching current and forecast together"""
+        lat, lng = coordinates
+        
+        current_weather, extracted_forecast = await asyncio.gather(
+            self.get_current_weather(lat, lng),
+            self.get_extracted_forecast(lat, lng, days=2))
+        
+        return self.weather.build_river_report(river_name, coordinates, current_weather,
+                                               extracted_forecast, include_hourly)
+
+# Global async weather system instance, sharing the sync instance's cache
+async_weather_system = AsyncWeatherSystem(weather_system)
@@ -0,0 +1,108 @@
+"""Local stand-in webhook for exercising AlertDispatcher.
+
+Accepts the {"alerts": [...]} batches AlertDispatcher POSTs, with
+configurable latency, 5xx errors and 429s, and keeps every accepted
+alert so delivery, retries and deduplication can be checked.
+
+    python -m benchmarks.alert_receiver --port 8002 --error-rate 0.2
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class ReceiverConfig:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit_rate=0.0):
+        self.latency = latency  # Seconds added to every response
+        self.jitter = jitter  # Extra uniform random seconds
+        self.error_rate = error_rate  # Fraction answered with 500
+        self.rate_limit_rate = rate_limit_rate  # Fraction answered with 429
+        self.stats = {'requests': 0, 'batches': 0, 'alerts': 0, 'errors': 0, 'rate_limited': 0}
+        self.received = []  # Accepted alerts in arrival order
+        self.lock = threading.Lock()
+    
+    def count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+    
+    def accept(self, alerts):
+        with self.lock:
+            self.stats['batches'] += 1
+            self.stats['alerts'] += len(alerts)
+            self.received.extend(alerts)
+
+class ReceiverHandler(BaseHTTPRequestHandler):
+    config = ReceiverConfig()
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def do_POST(self):
+        config = self.config
+        config.count('requests')
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        
+        if config.latency or config.jitter:
+            time.sleep(config.latency + random.uniform(0, config.jitter))
+        
+        roll = random.random()
+        if roll < config.rate_limit_rate:
+            config.count('rate_limited')
+            return self.send_json(429, {'error': 'rate limited'})
+        if roll < config.rate_limit_rate + config.error_rate:
+            config.count('errors')
+            return self.send_json(500, {'error': 'internal error'})
+        
+        try:
+            alerts = json.loads(body)['alerts']
+        except (ValueError, KeyError, TypeError):
+            return self.send_json(400, {'error': 'expected {"alerts": [...]}'})
+        
+        config.accept(alerts)
+        return self.send_json(200, {'accepted': len(alerts)})
+    
+    def do_GET(self):
+        """Counters and received alerts, for checking a run by hand"""
+        config = self.config
+        with config.lock:
+            return self.send_json(200, {'stats': dict(config.stats), 'alerts': list(config.received)})
+
+def start_receiver(config, host='127.0.0.1', port=0):
+    """Start the receiver on a background thread, returning (server, url)"""
+    handler = type('ConfiguredReceiverHandler', (ReceiverHandler,), {'config': config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='alert-receiver', daemon=True).start()
+    return server, f'http://{host}:{server.server_port}/alerts'
+
+def main():
+    parser = argparse.ArgumentParser(description='Local alert webhook stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8002)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    
+    config = ReceiverConfig(args.latency, args.jitter, args.error_rate, args.rate_limit_rate)
+    server, url = start_receiver(config, args.host, args.port)
+    print(f'Alert receiver listening on {url}; set ALERT_WEBHOOK_URLS={url}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+"""End-to-end load benchmark for the DebriSense Flask app.
+
+Starts the local weather stub, points WeatherSystem at it, serves the app on
+a threaded local server (or under uvicorn with --server asgi) and drives
+every endpoint with concurrent clients.
+Throughput, p50/p95/p99 latency per endpoint and memory are written to
+benchmarks/results/<time>-<commit>.json.
+
+    python -m benchmarks.run_benchmarks --requests 2000 --concurrency 16
+    python -m benchmarks.run_benchmarks --compare benchmarks/results/old.json
+    python -m benchmarks.run_benchmarks --server asgi --no-weather-cache --latency 0.5
+    python -m benchmarks.run_benchmarks --admission --concurrency 64
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from types import SimpleNamespace
+import numpy as np
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+# (name, method, path, json body) - one entry per route the dashboard and clients use
+ENDPOINTS = [
+    ('get_all_locations', 'GET', '/get_all_locations', None),
+    ('get_all_locations_paged', 'GET', '/get_all_locations?fields=id,lat,lng,pollution_level&limit=2', None),
+    ('detect_hotspots', 'GET', '/detect_hotspots', None),
+    ('get_update_schedule', 'GET', '/get_update_schedule', None),
+    ('nearest_rivers', 'GET', '/nearest_rivers?lat=5.5&lng=100.5&k=2', None),
+    ('get_sensor_data', 'GET', '/get_sensor_data/Sungai Klang', None),
+    ('get_weather_data', 'GET', '/get_weather_data/Sungai Inanam', None),
+    ('get_enhanced_predictions', 'GET', '/get_enhanced_predictions/Sungai Pinang', None),
+    ('test_weather', 'GET', '/test_weather/Sungai Klang', None),
+    ('predict_debris', 'POST', '/predict_debris',
+     {'rainfall': 25.5, 'wind_speed': 12.3, 'tide_level': 1.2, 'water_flow_rate': 150}),
+    ('predict_debris_batch', 'POST', '/predict_debris',
+     {'readings': [{'rainfall': r, 'wind_speed': 10, 'tide_level': 1.5, 'water_flow_rate': 150} for r in range(32)]}),
+    ('early_warning', 'POST', '/early_warning', {'rainfall': 35, 'wind_speed': 25, 'tide_level': 2.2}),
+    ('early_warning_fleet', 'GET', '/early_warning/fleet', None),
+    ('river_image', 'GET', '/data/image/sungaiKlang.png?w=320', None),
+    ('metrics', 'GET', '/metrics', None)
+]
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def max_rss_mb():
+    """Peak resident set size of this process (Linux reports KiB)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def start_app(args, weather_url):
+    """Import the app against the stub and serve it on a threaded local server"""
+    os.environ['WEATHER_API_BASE_URL'] = weather_url
+    os.environ.setdefault('WEATHER_API_KEY', 'benchmark')
+    os.environ['WEATHER_API_CALL_INTERVAL'] = str(args.api_call_interval)
+    # Admission control would turn a load test into a count of 429s; it is its own scenario
+    os.environ['ADMISSION_ENABLED'] = 'true' if args.admission else 'false'
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    import app as debrisense
+    from weather_system import weather_system
+    from response_cache import response_cache
+    
+    if args.no_weather_cache:
+        weather_system.cache_duration = 0
+    if args.no_response_cache:
+        response_cache.max_entries = 0
+    
+    if args.server == 'asgi':
+        import socket
+        import uvicorn
+        import asgi_app
+        
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        server = uvicorn.Server(uvicorn.Config(asgi_app.app, log_level='warning', access_log=False))
+        threading.Thread(target=server.run, kwargs={'sockets': [sock]}, name='benchmark-app', daemon=True).start()
+        while not server.started:
+            time.sleep(0.05)
+        # Same shutdown() interface as the werkzeug server
+        stopper = SimpleNamespace(shutdown=lambda: setattr(server, 'should_exit', True))
+        return stopper, f'http://127.0.0.1:{sock.getsockname()[1]}'
+    
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+    
+    server = make_server('127.0.0.1', 0, debrisense.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, name='benchmark-app', daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+def run_load(base_url, endpoints, total_requests, concurrency, timeout):
+    """Round-robin the endpoints over a pool of clients, returning raw samples"""
+    samples = defaultdict(list)  # name -> [(seconds, status)]
+    local = threading.local()
+    
+    def call(i):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        name, method, path, body = endpoints[i % len(endpoints)]
+        start = time.perf_counter()
+        try:
+            response = local.session.request(method, base_url + path, json=body, timeout=timeout)
+            status = response.status_code
+            response.content  # Include body transfer in the timing
+        except requests.exceptions.RequestException:
+            status = 0
+        samples[name].append((time.perf_counter() - start, status))
+    
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(call, range(total_requests)))
+    return samples, time.perf_counter() - start
+
+def summarize(samples, elapsed):
+    """Throughput and latency percentiles, per endpoint and overall"""
+    def stats(entries, seconds):
+        latencies = np.array([latency for latency, _ in entries]) * 1000
+        statuses = defaultdict(int)
+        for _, status in entries:
+            statuses[str(status)] += 1
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        return {
+            'requests': len(entries),
+            'throughput_rps': round(len(entries) / seconds, 2),
+            'latency_ms': {
+                'mean': round(float(latencies.mean()), 3),
+                'p50': round(float(p50), 3),
+                'p95': round(float(p95), 3),
+                'p99': round(float(p99), 3),
+                'max': round(float(latencies.max()), 3)
+            },
+            'status_counts': dict(statuses),
+            'error_rate': round(sum(n for s, n in statuses.items() if not s.startswith('2') and s != '304') / len(entries), 4)
+        }
+    
+    all_entries = [entry for entries in samples.values() for entry in entries]
+    return {
+        'overall': stats(all_entries, elapsed),
+        'endpoints': {name: stats(entries, elapsed) for name, entries in sorted(samples.items())}
+    }
+
+def compare(current, baseline_path):
+    """Print p50/p95 and throughput changes against an earlier result file"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    
+    print(f"\nCompared with {baseline.get('commit')} ({baseline_path}):")
+    print(f"{'endpoint':32} {'p50 ms':>18} {'p95 ms':>18} {'rps':>16}")
+    for name, stats in current['endpoints'].items():
+        old = baseline.get('endpoints', {}).get(name)
+        if old is None:
+            continue
+        cells = []
+        for new_value, old_value in ((stats['latency_ms']['p50'], old['latency_ms']['p50']),
+                                     (stats['latency_ms']['p95'], old['latency_ms']['p95']),
+                                     (stats['throughput_rps'], old['throughput_rps'])):
+            change = (new_value - old_value) / old_value * 100 if old_value else 0.0
+            cells.append(f'{new_value:9.2f} ({change:+6.1f}%)')
+        print(f'{name:32} ' + ' '.join(f'{cell:>18}' for cell in cells))
+
+def main():
+    parser = argparse.ArgumentParser(description='DebriSense end-to-end load benchmark')
+    parser.add_argument('--requests', type=int, default=1500, help='total requests across all endpoints')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--warmup', type=int, default=1, help='warm-up passes over every endpoint')
+    parser.add_argument('--only', help='comma separated endpoint names to include')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--latency', type=float, default=0.05, help='stub upstream latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--mode', choices=('synthetic', 'record', 'replay'), default='synthetic')
+    parser.add_argument('--payload-dir', default=os.path.join(ROOT, 'benchmarks', 'payloads'))
+    parser.add_argument('--api-call-interval', type=float, default=0.0,
+                        help='WeatherSystem spacing between upstream calls (production uses 1s)')
+    parser.add_argument('--server', choices=('wsgi', 'asgi'), default='wsgi',
+                        help='serve the Flask app threaded, or asgi_app under uvicorn')
+    parser.add_argument('--admission', action='store_true',
+                        help='keep admission control on (rate limits and load shedding) to measure it')
+    parser.add_argument('--no-weather-cache', action='store_true')
+    parser.add_argument('--no-response-cache', action='store_true')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='also record the Python heap peak with tracemalloc (slows the run)')
+    parser.add_argument('--output', help='result file (default benchmarks/results/<time>-<commit>.json)')
+    parser.add_argument('--compare', help='earlier result file to compare against')
+    args = parser.parse_args()
+    
+    sys.path.insert(0, ROOT)
+    from benchmarks.weather_stub import StubConfig, start_stub
+    
+    endpoints = ENDPOINTS
+    if args.only:
+        wanted = set(args.only.split(','))
+        endpoints = [endpoint for endpoint in ENDPOINTS if endpoint[0] in wanted]
+    
+    stub_config = StubConfig(args.latency, args.jitter, args.error_rate, args.rate_limit_rate,
+                             args.mode, args.payload_dir)
+    stub, weather_url = start_stub(stub_config)
+    
+    if args.trace_memory:
+        tracemalloc.start()
+    rss_before = max_rss_mb()
+    server, base_url = start_app(args, weather_url)
+    rss_after_import = max_rss_mb()
+    
+    run_load(base_url, endpoints, len(endpoints) * args.warmup, 1, args.timeout)
+    samples, elapsed = run_load(base_url, endpoints, args.requests, args.concurrency, args.timeout)
+    
+    traced_peak = None
+    if args.trace_memory:
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    server.shutdown()
+    stub.shutdown()
+    
+    result = {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'elapsed_seconds': round(elapsed, 3),
+        'memory_mb': {
+            'rss_before_app': round(rss_before, 1),
+            'rss_after_import': round(rss_after_import, 1),
+            'rss_peak': round(max_rss_mb(), 1),
+            'python_heap_peak': round(traced_peak / 2 ** 20, 1) if traced_peak is not None else None
+        },
+        'upstream': dict(stub_config.stats),
+        **summarize(samples, elapsed)
+    }
+    
+    output = args.output or os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{result['commit']}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    
+    overall = result['overall']
+    print(f"{overall['requests']} requests in {elapsed:.2f}s: {overall['throughput_rps']} req/s, "
+          f"p50 {overall['latency_ms']['p50']} ms, p95 {overall['latency_ms']['p95']} ms, "
+          f"p99 {overall['latency_ms']['p99']} ms, peak RSS {result['memory_mb']['rss_peak']} MB")
+    for name, stats in result['endpoints'].items():
+        print(f"  {name:32} p50 {stats['latency_ms']['p50']:9.2f} ms  p95 {stats['latency_ms']['p95']:9.2f} ms  "
+              f"p99 {stats['latency_ms']['p99']:9.2f} ms  errors {stats['error_rate']:.2%}")
+    print(f'Results written to {output}')
+    
+    if args.compare:
+        compare(result, args.compare)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""Local stand-in for api.weatherapi.com used by the benchmarks.
+
+Serves /v1/current.json and /v1/forecast.json (including POSTed bulk
+forecasts) in the shapes WeatherSystem reads, with configurable latency,
+5xx errors and 429s. In record mode every
+request is proxied to the real API and the payload saved; in replay mode
+saved payloads are served back, falling back to synthetic data.
+
+    python -m benchmarks.weather_stub --port 8001 --latency 0.2 --rate-limit-rate 0.05
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import requests
+
+UPSTREAM_URL = 'http://api.weatherapi.com/v1'
+
+class StubConfig:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit_rate=0.0,
+                 mode='synthetic', payload_dir='benchmarks/payloads', upstream_key=None):
+        self.latency = latency  # Seconds added to every response
+        self.jitter = jitter  # Extra uniform random seconds
+        self.error_rate = error_rate  # Fraction answered with 500
+        self.rate_limit_rate = rate_limit_rate  # Fraction answered with 429
+        self.mode = mode  # synthetic, record or replay
+        self.payload_dir = payload_dir
+        self.upstream_key = upstream_key or os.environ.get('WEATHER_API_KEY')
+        self.stats = {'requests': 0, 'bulk_locations': 0, 'errors': 0, 'rate_limited': 0, 'replayed': 0, 'recorded': 0}
+        self.lock = threading.Lock()
+    
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+def location_seed(query):
+    """Stable seed per location so repeated queries get the same weather"""
+    return int(hashlib.md5(query.encode()).hexdigest()[:8], 16)
+
+def synthetic_hour(rng, epoch):
+    rainfall = round(max(0.0, rng.gauss(0.8, 1.5)), 1)
+    return {
+        'time_epoch': epoch,
+        'time': datetime.fromtimestamp(epoch).strftime('%Y-%m-%d %H:%M'),
+        'temp_c': round(rng.uniform(24, 33), 1),
+        'precip_mm': rainfall,
+        'wind_kph': round(rng.uniform(3, 28), 1),
+        'wind_degree': rng.randint(0, 359),
+        'humidity': rng.randint(65, 95),
+        'condition': {'text': 'Patchy rain possible' if rainfall else 'Partly cloudy'}
+    }
+
+def synthetic_current(query):
+    rng = random.Random(location_seed(query) + int(time.time() // 900))
+    lat, lng = (float(part) for part in query.split(','))
+    return {
+        'location': {'name': 'Stub', 'region': '', 'country': 'Malaysia', 'lat': lat, 'lon': lng,
+                     'localtime_epoch': int(time.time())},
+        'current': {
+            'last_updated_epoch': int(time.time()),
+            'last_updated': datetime.now().strftime('%Y-%m-%d %H:%M'),
+            'temp_c': round(rng.uniform(25, 32), 1),
+            'precip_mm': round(rng.uniform(0, 4), 1),
+            'wind_kph': round(rng.uniform(4, 22), 1),
+            'wind_degree': rng.randint(0, 359),
+            'humidity': rng.randint(70, 92),
+            'condition': {'text': 'Partly cloudy'}
+        }
+    }
+
+def synthetic_forecast(query, days):
+    rng = random.Random(location_seed(query))
+    payload = synthetic_current(query)
+    midnight = int(time.time() // 86400 * 86400)
+    forecast_days = []
+    
+    for day in range(days):
+        start = midnight + day * 86400
+        hours = [synthetic_hour(rng, start + hour * 3600) for hour in range(24)]
+        forecast_days.append({
+            'date': datetime.fromtimestamp(start).strftime('%Y-%m-%d'),
+            'date_epoch': start,
+            'day': {
+                'maxtemp_c': max(h['temp_c'] for h in hours),
+                'mintemp_c': min(h['temp_c'] for h in hours),
+                'avgtemp_c': round(sum(h['temp_c'] for h in hours) / 24, 1),
+                'totalprecip_mm': round(sum(h['precip_mm'] for h in hours), 1),
+                'maxwind_kph': max(h['wind_kph'] for h in hours),
+                'avghumidity': round(sum(h['humidity'] for h in hours) / 24),
+                'condition': {'text': 'Patchy rain possible'}
+            },
+            'hour': hours
+        })
+    
+    payload['forecast'] = {'forecastday': forecast_days}
+    return payload
+
+class StubHandler(BaseHTTPRequestHandler):
+    config = StubConfig()
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def payload_path(self, endpoint, params):
+        key = json.dumps({k: v for k, v in sorted(params.items()) if k != 'key'})
+        name = f"{endpoint.replace('.json', '')}-{hashlib.sha1(key.encode()).hexdigest()[:16]}.json"
+        return os.path.join(self.config.payload_dir, name)
+    
+    def simulate_upstream(self):
+        """Apply latency, then maybe answer with a 429 or 500; True when an error was sent"""
+        config = self.config
+        if config.latency or config.jitter:
+            time.sleep(config.latency + random.uniform(0, config.jitter))
+        
+        roll = random.random()
+        if roll < config.rate_limit_rate:
+            config.count('rate_limited')
+            self.send_json(429, {'error': {'code': 2007, 'message': 'API key has exceeded calls per month quota.'}})
+            return True
+        if roll < config.rate_limit_rate + config.error_rate:
+            config.count('errors')
+            self.send_json(500, {'error': {'code': 9999, 'message': 'Internal application error.'}})
+            return True
+        return False
+    
+    def do_POST(self):
+        """Bulk forecasts: q=bulk with {"locations": [{"q": ..., "custom_id": ...}]}"""
+        config = self.config
+        config.count('requests')
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        
+        if self.simulate_upstream():
+            return
+        if url.path.rsplit('/', 1)[-1] != 'forecast.json' or params.get('q') != 'bulk':
+            return self.send_json(400, {'error': {'code': 1006, 'message': 'No matching location found.'}})
+        
+        days = int(params.get('days', 1))
+        bulk = []
+        for location in body.get('locations', []):
+            config.count('bulk_locations')
+            bulk.append({'query': {'custom_id': location.get('custom_id'), 'q': location['q'],
+                                   **synthetic_forecast(location['q'], days)}})
+        return self.send_json(200, {'bulk': bulk})
+    
+    def do_GET(self):
+        config = self.config
+        config.count('requests')
+        url = urlparse(self.path)
+        endpoint = url.path.rsplit('/', 1)[-1]
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        
+        if endpoint not in ('current.json', 'forecast.json') or 'q' not in params:
+            return self.send_json(400, {'error': {'code': 1006, 'message': 'No matching location found.'}})
+        
+        if self.simulate_upstream():
+            return
+        
+        path = self.payload_path(endpoint, params)
+        
+        if config.mode == 'record':
+            response = requests.get(f'{UPSTREAM_URL}/{endpoint}', params={**params, 'key': config.upstream_key}, timeout=10)
+            if response.status_code == 200:
+                os.makedirs(config.payload_dir, exist_ok=True)
+                with open(path, 'w') as f:
+                    f.write(response.text)
+                config.count('recorded')
+            return self.send_json(response.status_code, response.json())
+        
+        if config.mode == 'replay' and os.path.exists(path):
+            with open(path) as f:
+                config.count('replayed')
+                return self.send_json(200, json.load(f))
+        
+        if endpoint == 'current.json':
+            return self.send_json(200, synthetic_current(params['q']))
+        return self.send_json(200, synthetic_forecast(params['q'], int(params.get('days', 1))))
+
+def start_stub(config, host='127.0.0.1', port=0):
+    """Start the stub on a background thread, returning (server, base_url)"""
+    handler = type('ConfiguredStubHandler', (StubHandler,), {'config': config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='weather-stub', daemon=True).start()
+    return server, f'http://{host}:{server.server_port}/v1'
+
+def main():
+    parser = argparse.ArgumentParser(description='Local WeatherAPI stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--mode', choices=('synthetic', 'record', 'replay'), default='synthetic')
+    parser.add_argument('--payload-dir', default='benchmarks/payloads')
+    args = parser.parse_args()
+    
+    config = StubConfig(args.latency, args.jitter, args.error_rate, args.rate_limit_rate,
+                        args.mode, args.payload_dir)
+    server, base_url = start_stub(config, args.host, args.port)
+    print(f'Weather stub serving {base_url} ({args.mode}); set WEATHER_API_BASE_URL={base_url}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,127 @@
 import numpy as np
 from datetime import datetime, timedelta
 import math
+import time
+
+from metrics import MODEL_PREDICT_SECONDS, MODEL_PREDICT_ROWS
+from profiling import stage
+from tide_system import tide_engine
 
 class EnhancedAIPredictor:
     def __init__(self):
         self.base_model = None  # Will be loaded from the main app
         self.scaler = None      # Will be loaded from the main app
+        self.forest_arrays = None  # Flattened trees for vectorized inference
+        self.interval_level = 0.9  # Coverage of the reported prediction interval
+        self.quantile_levels = (0.05, 0.25, 0.5, 0.75, 0.95)
         
     def set_models(self, model, scaler):
         """Set the trained ML models"""
         self.base_model = model
         self.scaler = scaler
+        self.forest_arrays = self.flatten_forest(model)
+    
+    def flatten_forest(self, model):
+        """Pack every tree of the forest into shared node arrays"""
+        estimators = getattr(model, 'estimators_', None)
+        if not estimators:
+            return None
+        
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        max_depth = 0
+        offset = 0
+        
+        for estimator in estimators:
+            tree = estimator.tree_
+            node_ids = np.arange(tree.node_count) + offset
+            is_leaf = tree.children_left == -1
+            
+            # Leaves point back at themselves so extra traversal steps are no-ops
+            lefts.append(np.where(is_leaf, node_ids, tree.children_left + offset))
+            rights.append(np.where(is_leaf, node_ids, tree.children_right + offset))
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(tree.threshold)
+            values.append(tree.value[:, 0, 0])
+            roots.append(offset)
+            
+            max_depth = max(max_depth, tree.max_depth)
+            offset += tree.node_count
+        
+        return {
+            'feature': np.concatenate(features).astype(np.intp),
+            'threshold': np.concatenate(thresholds),
+            'left': np.concatenate(lefts).astype(np.intp),
+            'right': np.concatenate(rights).astype(np.intp),
+            'value': np.concatenate(values),
+            'roots': np.array(roots, dtype=np.intp),
+            'max_depth': max_depth
+        }
+    
+    def get_tree_predictions(self, features_scaled):
+        """Evaluate all trees at once, returning an (n_trees, n_samples) array"""
+        features_scaled = np.asarray(features_scaled, dtype=np.float64)
+        
+        if self.forest_arrays is None:
+            # Not a forest - a single model output has no spread
+            return self.base_model.predict(features_scaled).reshape(1, -1)
+        
+        forest = self.forest_arrays
+        # Trees split on float32 inputs, so compare the same way predict() does
+        samples = features_scaled.astype(np.float32)
+        sample_idx = np.arange(samples.shape[0])[np.newaxis, :]
+        nodes = np.repeat(forest['roots'][:, np.newaxis], samples.shape[0], axis=1)
+        
+        # Walk every tree for every sample one depth level per step
+        for _ in range(forest['max_depth']):
+            go_left = samples[sample_idx, forest['feature'][nodes]] <= forest['threshold'][nodes]
+            nodes = np.where(go_left, forest['left'][nodes], forest['right'][nodes])
+        
+        return forest['value'][nodes]
+    
+    def predict_with_uncertainty(self, feature_matrix):
+        """Predict a batch of raw feature rows with per-tree intervals and quantiles"""
+        feature_matrix = np.atleast_2d(np.asarray(feature_matrix, dtype=np.float64))
+        
+        with stage('scaling'):
+            features_scaled = self.scaler.transform(feature_matrix)
+        
+        start = time.perf_counter()
+        with stage('inference'):
+            tree_predictions = self.get_tree_predictions(features_scaled)
+        MODEL_PREDICT_SECONDS.observe(time.perf_counter() - start)
+        MODEL_PREDICT_ROWS.inc(len(feature_matrix))
+        
+        tail = (1.0 - self.interval_level) / 2
+        levels = np.array([tail, 1.0 - tail, *self.quantile_levels])
+        bounds = np.quantile(tree_predictions, levels, axis=0)
+        
+        return {
+            'mean': tree_predictions.mean(axis=0),
+            'std': tree_predictions.std(axis=0),
+            'lower': bounds[0],
+            'upper': bounds[1],
+            'quantiles': dict(zip(self.quantile_levels, bounds[2:]))
+        }
+    
+    def calculate_model_confidence(self, mean, lower, upper):
+        """Turn the width of the prediction interval into a 0-1 confidence"""
+        relative_width = (np.asarray(upper) - np.asarray(lower)) / (2 * np.maximum(np.abs(mean), 1.0))
+        return np.clip(1.0 - relative_width, 0.0, 1.0)
+    
+    def format_uncertainty(self, uncertainty, index, scale=1.0):
+        """Build the JSON-friendly interval and quantile fields for one row"""
+        return {
+            'prediction_interval': {
+                'lower': round(float(uncertainty['lower'][index]) * scale, 1),
+                'upper': round(float(uncertainty['upper'][index]) * scale, 1),
+                'level': self.interval_level
+            },
+            'quantiles': {
+                f'p{int(round(q * 100)):02d}': round(float(values[index]) * scale, 1)
+                for q, values in uncertainty['quantiles'].items()
+            },
+            'std': round(float(uncertainty['std'][index]) * scale, 2)
+        }
     
     def calculate_data_quality_score(self, sensor_data, weather_data):
         """Calculate confidence based on data quality"""
@@ -48,60 +159,82 @@ class EnhancedAIPredictor:
     
     def predict_debris_level(self, sensor_data, weather_data, timeframe_hours=24):
         """Predict debris level for a specific timeframe"""
+        return self.predict_timeframes(sensor_data, weather_data, [timeframe_hours])[0]
+    
+    def predict_timeframes(self, sensor_data, weather_data, timeframes):
+        """Predict debris levels for several timeframes in one forest pass"""
         if not self.base_model or not self.scaler:
-            return {
+            return [{
                 'error': 'AI model not loaded',
                 'prediction': None,
                 'confidence': 0.0
-            }
+            } for _ in timeframes]
         
         try:
-            # Extract features from sensor data
-            sensor_features = self.extract_sensor_features(sensor_data)
-            
-            # Extract features from weather data
-            weather_features = self.extract_weather_features(weather_data, timeframe_hours)
-            
-            # Combine features
-            combined_features = {**sensor_features, **weather_features}
+            with stage('features'):
+                # Extract features from sensor data
+                sensor_features = self.extract_sensor_features(sensor_data)
+                
+                feature_sets = []
+                for timeframe_hours in timeframes:
+                    # Extract features from weather data
+                    weather_features = self.extract_weather_features(weather_data, timeframe_hours)
+                    
+                    # Predicted tide at the end of the timeframe
+                    tide_features = self.extract_tide_features(sensor_data, timeframe_hours)
+                    
+                    # Combine features
+                    feature_sets.append({**sensor_features, **weather_features, **tide_features})
             
-            # Prepare feature vector for ML model
-            feature_vector = np.array([
+            # Prepare feature matrix for ML model, one row per timeframe
+            feature_matrix = np.array([[
                 combined_features.get('rainfall', 0),
                 combined_features.get('wind_speed', 0),
-                combined_features.get('tide_level', 0),
+                combined_features.get('forecast_tide_level', combined_features.get('tide_level', 0)),
                 combined_features.get('water_flow_rate', 0)
-            ]).reshape(1, -1)
-            
-            # Scale features
-            feature_vector_scaled = self.scaler.transform(feature_vector)
-            
-            # Make prediction
-            base_prediction = self.base_model.predict(feature_vector_scaled)[0]
+            ] for combined_features in feature_sets])
             
-            # Adjust prediction based on timeframe
-            adjusted_prediction = self.adjust_prediction_for_timeframe(base_prediction, timeframe_hours, weather_data)
+            # Make predictions with per-tree spread
+            uncertainty = self.predict_with_uncertainty(feature_matrix)
+            model_confidence = self.calculate_model_confidence(
+                uncertainty['mean'], uncertainty['lower'], uncertainty['upper'])
             
-            # Calculate confidence
-            confidence = self.calculate_data_quality_score(sensor_data, weather_data)
+            # Data quality is the same for every timeframe
+            data_quality = self.calculate_data_quality_score(sensor_data, weather_data)
             
-            # Calculate risk level
-            risk_level = self.calculate_risk_level(adjusted_prediction)
+            results = []
+            for i, timeframe_hours in enumerate(timeframes):
+                base_prediction = float(uncertainty['mean'][i])
+                
+                # Adjust prediction based on timeframe
+                adjusted_prediction = self.adjust_prediction_for_timeframe(base_prediction, timeframe_hours, weather_data)
+                scale = adjusted_prediction / base_prediction if base_prediction else 1.0
+                
+                # Calculate confidence from data quality and forest agreement
+                confidence = data_quality * float(model_confidence[i])
+                
+                # Calculate risk level
+                risk_level = self.calculate_risk_level(adjusted_prediction)
+                
+                results.append({
+                    'prediction': round(adjusted_prediction, 1),
+                    'risk_level': risk_level,
+                    'confidence': round(confidence, 2),
+                    'data_quality': round(data_quality, 2),
+                    'model_confidence': round(float(model_confidence[i]), 2),
+                    **self.format_uncertainty(uncertainty, i, scale),
+                    'timeframe_hours': timeframe_hours,
+                    'features_used': feature_sets[i]
+                })
             
-            return {
-                'prediction': round(adjusted_prediction, 1),
-                'risk_level': risk_level,
-                'confidence': round(confidence, 2),
-                'timeframe_hours': timeframe_hours,
-                'features_used': combined_features
-            }
+            return results
             
         except Exception as e:
-            return {
+            return [{
                 'error': f'Prediction error: {str(e)}',
                 'prediction': None,
                 'confidence': 0.0
-            }
+            } for _ in timeframes]
     
     def extract_sensor_features(self, sensor_data):
         """Extract features from sensor data"""
@@ -125,6 +258,16 @@ class EnhancedAIPredictor:
         
         return features
     
+    def extract_tide_features(self, sensor_data, timeframe_hours):
+        """Extract predicted tide features from the river's tide table"""
+        river_name = sensor_data.get('river_name') if sensor_data else None
+        if river_name is None or not tide_engine.has_station(river_name):
+            return {}
+        
+        # Table lookups, normalized like the sensor tide level
+        tide = tide_engine.window_features(river_name, timeframe_hours)
+        return {name: min(level / 2.5, 1.0) for name, level in tide.items()}
+    
     def extract_weather_features(self, weather_data, timeframe_hours):
         """Extract weather features for prediction"""
         features = {}
@@ -143,7 +286,11 @@ class EnhancedAIPredictor:
             
             # Forecast features for the specific timeframe
             forecast = weather_data.get('forecast', {})
-            if isinstance(forecast, list) and len(forecast) > 0:
+            series = getattr(weather_data, 'series', None)
+            if series is not None and len(series) > 0:
+                # Hourly prefix sums make any horizon a constant-time lookup
+                features.update(series.window_features(timeframe_hours))
+            elif isinstance(forecast, list) and len(forecast) > 0:
                 # Calculate forecast features for the prediction timeframe
                 forecast_features = self.calculate_forecast_features(forecast, timeframe_hours)
                 features.update(forecast_features)
@@ -239,13 +386,9 @@ class EnhancedAIPredictor:
     def get_multiple_predictions(self, sensor_data, weather_data):
         """Get predictions for multiple timeframes"""
         timeframes = [6, 12, 24]  # hours
-        predictions = {}
-        
-        for timeframe in timeframes:
-            prediction = self.predict_debris_level(sensor_data, weather_data, timeframe)
-            predictions[f'{timeframe}h'] = prediction
+        results = self.predict_timeframes(sensor_data, weather_data, timeframes)
         
-        return predictions
+        return {f'{timeframe}h': prediction for timeframe, prediction in zip(timeframes, results)}
 
 # Global AI predictor instance
 enhanced_ai = EnhancedAIPredictor()
@@ -27,6 +27,14 @@ window.darkTileLayer = L.tileLayer('https://{s}.basemaps.cartocdn.com/dark_all/{
 // Store map globally for theme switching
 window.map = map;
 
+// Interpolated pollution and predicted debris surfaces, rendered server side as tiles
+const surfaceTileOptions = { maxNativeZoom: 16, maxZoom: 19, opacity: 0.7, zIndex: 10 };
+const surfaceLayers = {
+    'Pollution surface': L.tileLayer('/tiles/pollution/{z}/{x}/{y}.png', surfaceTileOptions),
+    'Predicted debris (24h)': L.tileLayer('/tiles/debris/{z}/{x}/{y}.png', surfaceTileOptions)
+};
+L.control.layers(null, surfaceLayers, { position: 'topright' }).addTo(map);
+
 // Create custom donut marker for rivers
 const donutIcon = L.divIcon({
     className: 'custom-donut-marker',
@@ -38,7 +46,7 @@ const donutIcon = L.divIcon({
 // Load all locations and create markers
 async function loadAllLocations() {
     try {
-        const response = await fetch('/get_all_locations');
+        const response = await fetch('/get_all_locations?fields=id,lat,lng,name,image,pollution_level');
         const data = await response.json();
         
         data.locations.forEach(location => {
@@ -83,7 +91,7 @@ async function showEnhancedLocationInfo(locationData) {
     // Show loading state
     locationInfo.innerHTML = `
         <div class="location-image">
-            <img src="/data/image/${locationData.image}" alt="${locationData.name}" class="location-img" 
+            <img src="/data/image/${locationData.image}?w=320" srcset="/data/image/${locationData.image}?w=320 1x, /data/image/${locationData.image}?w=640 2x" alt="${locationData.name}" class="location-img" 
                  onerror="console.log('Image failed to load:', this.src); this.style.display='none'; this.nextElementSibling.style.display='block';"
                  onload="console.log('Image loaded successfully:', this.src);">
             <div class="no-image" style="display: none; padding: 40px; text-align: center; color: #cccccc; background: rgba(255,255,255,0.05);">
@@ -125,7 +133,7 @@ function updateSidebarWithEnhancedData(locationData, sensorData, weatherData, pr
     
     locationInfo.innerHTML = `
         <div class="location-image">
-            <img src="/data/image/${locationData.image}" alt="${locationData.name}" class="location-img">
+            <img src="/data/image/${locationData.image}?w=320" srcset="/data/image/${locationData.image}?w=320 1x, /data/image/${locationData.image}?w=640 2x" alt="${locationData.name}" class="location-img">
         </div>
         
         <div class="river-name">
@@ -564,7 +572,7 @@ function showBasicLocationInfo(locationData) {
     const locationInfo = document.getElementById('location-info');
     locationInfo.innerHTML = `
         <div class="location-image">
-            <img src="/data/image/${locationData.image}" alt="${locationData.name}" class="location-img">
+            <img src="/data/image/${locationData.image}?w=320" srcset="/data/image/${locationData.image}?w=320 1x, /data/image/${locationData.image}?w=640 2x" alt="${locationData.name}" class="location-img">
         </div>
         
         <div class="river-name">
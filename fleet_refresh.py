@@ -0,0 +1,199 @@
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from datetime import datetime
+
+from sensor_system import sensor_system
+from weather_system import weather_system
+from enhanced_ai import enhanced_ai
+from site_registry import site_registry
+
+def init_predict_worker(model_path, scaler_path):
+    """Process pool initializer: load the models once per worker"""
+    import joblib
+    enhanced_ai.set_models(joblib.load(model_path), joblib.load(scaler_path))
+
+def predict_shard(rivers, budget):
+    """Predictions for (river_name, sensor_data, weather_data) rows, stopping after budget seconds"""
+    deadline = time.time() + budget  # Counted from when a worker picks the shard up
+    results = {}
+    for river_name, sensor_data, weather_data in rivers:
+        if time.time() >= deadline:
+            break
+        results[river_name] = enhanced_ai.get_multiple_predictions(sensor_data, weather_data)
+    return results
+
+class FleetRefresher:
+    def __init__(self, shard_size=None, processes=None, io_threads=None, shard_budget=None):
+        self.shard_size = shard_size or int(os.environ.get('FLEET_SHARD_SIZE', 64))
+        # 0 processes runs inference on the I/O threads (small fleets, or no fork/spawn available)
+        self.processes = processes if processes is not None else \
+            int(os.environ.get('FLEET_PROCESSES', os.cpu_count() or 1))
+        self.io_threads = io_threads or int(os.environ.get('FLEET_IO_THREADS', 8))
+        self.shard_budget = shard_budget or float(os.environ.get('FLEET_SHARD_BUDGET', 30))  # Seconds per shard
+        self.model_paths = ('models/debris_predictor.pkl', 'models/scaler.pkl')
+        self.process_pool = None
+        self.pool_lock = threading.Lock()
+        # A shard is only submitted once a worker is free, so no shard spends its budget queued
+        self.process_slots = threading.BoundedSemaphore(max(self.processes, 1))
+        self.refresh_lock = threading.Lock()  # One refresh at a time
+        self.publish_lock = threading.Lock()  # Keeps snapshot and version in step
+        self.snapshot = None
+        self.version = 0  # Bumped on every publish
+        self.on_publish = []  # Callbacks given each published snapshot
+        self.running = False
+    
+    def get_process_pool(self):
+        """Process pool for inference, started on first use and kept warm"""
+        with self.pool_lock:
+            if self.process_pool is None:
+                # Spawned workers do not inherit the parent's threads and locks
+                self.process_pool = ProcessPoolExecutor(
+                    max_workers=self.processes, mp_context=multiprocessing.get_context('spawn'),
+                    initializer=init_predict_worker, initargs=self.model_paths)
+                atexit.register(self.shutdown)
+            return self.process_pool
+    
+    def shutdown(self):
+        with self.pool_lock:
+            if self.process_pool is not None:
+                self.process_pool.shutdown(wait=False, cancel_futures=True)
+                self.process_pool = None
+    
+    def shards(self, locations):
+        return [locations[i:i + self.shard_size] for i in range(0, len(locations), self.shard_size)]
+    
+    def fetch_shard(self, shard):
+        """I/O for one shard: sensor readings and weather for every river in it"""
+        weather_reports = weather_system.get_weather_for_rivers(dict(shard))
+        return [(river_name, sensor_system.get_sensor_data_for_river(river_name), weather_reports[river_name])
+                for river_name, _ in shard]
+    
+    def run_shard(self, index, shard):
+        """Fetch a shard on an I/O thread, then predict it in the process pool within its budget"""
+        started = time.time()
+        status = 'complete'
+        predictions = {}
+        rows = []
+        
+        try:
+            rows = self.fetch_shard(shard)
+            # The budget covers the shard's I/O and inference, not time spent waiting for a worker
+            budget = max(0.0, self.shard_budget - (time.time() - started))
+            if self.processes > 0:
+                self.process_slots.acquire()
+                try:
+                    future = self.get_process_pool().submit(predict_shard, rows, budget)
+                except Exception:
+                    self.process_slots.release()
+                    raise
+                # The slot is freed when the worker is done, even if we stop waiting first
+                future.add_done_callback(lambda _: self.process_slots.release())
+                predictions = future.result(timeout=budget + 1.0)
+            else:
+                predictions = predict_shard(rows, budget)
+        except FutureTimeout:
+            status = 'timed_out'
+        except Exception as e:
+            status = f'failed: {e}'
+        
+        if status == 'complete' and len(predictions) < len(shard):
+            status = 'partial'
+        
+        timestamp = datetime.now().isoformat()
+        entries = {river_name: {
+            'river_name': river_name,
+            'timestamp': timestamp,
+            'predictions': predictions[river_name],
+            'sensor_data': sensor_data,
+            'weather_data': weather_data
+        } for river_name, sensor_data, weather_data in rows if river_name in predictions}
+        
+        return entries, {
+            'shard': index,
+            'rivers': len(shard),
+            'refreshed': len(entries),
+            'status': status,
+            'seconds': round(time.time() - started, 3)
+        }
+    
+    def refresh(self):
+        """Refresh every site and publish the merged snapshot, keeping stale entries for shards that missed"""
+        with self.refresh_lock:
+            self.running = True
+            started = time.time()
+            try:
+                shards = self.shards(site_registry.locations())
+                
+                with ThreadPoolExecutor(max_workers=self.io_threads, thread_name_prefix='fleet-io') as pool:
+                    futures = [pool.submit(self.run_shard, i, shard) for i, shard in enumerate(shards)]
+                    results = [future.result() for future in futures]
+                
+                # Sites whose shard missed its budget keep their previous entry, marked stale
+                previous = self.snapshot['rivers'] if self.snapshot else {}
+                rivers = {}
+                for shard, (entries, _) in zip(shards, results):
+                    for river_name, _ in shard:
+                        if river_name in entries:
+                            rivers[river_name] = entries[river_name]
+                        elif river_name in previous:
+                            rivers[river_name] = {**previous[river_name], 'stale': True}
+                
+                shard_reports = [report for _, report in results]
+                return self.publish({
+                    'started': datetime.fromtimestamp(started).isoformat(),
+                    'completed': datetime.now().isoformat(),
+                    'duration_seconds': round(time.time() - started, 3),
+                    'complete': all(report['status'] == 'complete' for report in shard_reports),
+                    'shards': shard_reports,
+                    'rivers': rivers
+                })
+            finally:
+                self.running = False
+    
+    def publish(self, snapshot):
+        """Swap in a new snapshot and notify listeners"""
+        with self.publish_lock:
+            snapshot['version'] = self.version + 1
+            # Snapshot first, version last: a reader never sees a version with an older snapshot
+            self.snapshot = snapshot
+            self.version = snapshot['version']
+        for callback in self.on_publish:
+            callback(snapshot)
+        return snapshot
+    
+    def refresh_async(self):
+        """Start a refresh on a background thread unless one is running"""
+        if self.running:
+            return False
+        threading.Thread(target=self.refresh, name='fleet-refresh', daemon=True).start()
+        return True
+    
+    def start_interval(self, interval_seconds):
+        """Refresh the fleet every interval_seconds in the background"""
+        def loop():
+            while True:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"Fleet refresh error: {e}")
+                time.sleep(interval_seconds)
+        
+        threading.Thread(target=loop, name='fleet-refresh-interval', daemon=True).start()
+    
+    def current(self):
+        """(version, snapshot) of the latest publish, read together"""
+        with self.publish_lock:
+            return self.version, self.snapshot
+    
+    def river_entry(self, river_name):
+        """Latest snapshot entry for a river, or None"""
+        if self.snapshot is None:
+            return None
+        return self.snapshot['rivers'].get(river_name)
+
+# Global fleet refresher instance
+fleet_refresher = FleetRefresher()
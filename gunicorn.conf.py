@@ -0,0 +1,23 @@
+import os
+import shutil
+import tempfile
+
+# Shared directory for per-worker Prometheus samples. It must be set before
+# the workers import the app, and is emptied on every start.
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR',
+                                    os.path.join(tempfile.gettempdir(), 'debrisense-metrics'))
+shutil.rmtree(metrics_dir, ignore_errors=True)
+os.makedirs(metrics_dir, exist_ok=True)
+
+def child_exit(server, worker):
+    """Drop live gauges of workers that have exited"""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+def when_ready(server):
+    """Run a single worker when the app refreshes the fleet in the background"""
+    # Each worker would run its own refresh loop and keep its own snapshot
+    if float(os.environ.get('FLEET_REFRESH_INTERVAL', 0)) > 0 and server.num_workers > 1:
+        server.log.warning('FLEET_REFRESH_INTERVAL is set: running 1 worker instead of %s '
+                           '(scale with --threads)', server.num_workers)
+        server.num_workers = 1
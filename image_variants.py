@@ -0,0 +1,128 @@
+import hashlib
+import os
+import tempfile
+import threading
+from werkzeug.security import safe_join
+
+try:
+    from PIL import Image
+except ImportError:  # Without Pillow only the original files are served
+    Image = None
+
+# Widths we render, so arbitrary ?w= values cannot fill the disk
+ALLOWED_WIDTHS = (160, 320, 640, 960, 1280)
+
+# Output format -> (Pillow format, mimetype, save options)
+FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True})
+}
+
+class ImageVariantCache:
+    def __init__(self, source_dir='data/image', cache_dir='data/image/.cache'):
+        self.source_dir = source_dir
+        self.cache_dir = cache_dir
+        self.max_age = int(os.environ.get('IMAGE_CACHE_MAX_AGE', 30 * 24 * 3600))
+        self.locks = {}  # One lock per variant so it is only rendered once
+        self.locks_guard = threading.Lock()
+    
+    @property
+    def enabled(self):
+        return Image is not None
+    
+    def bound_width(self, width):
+        """Round a requested width up to the nearest rendered width"""
+        for allowed in ALLOWED_WIDTHS:
+            if width <= allowed:
+                return allowed
+        return ALLOWED_WIDTHS[-1]
+    
+    def choose_format(self, requested, accept_header):
+        """Use the requested format, else WebP when the client accepts it"""
+        if requested in FORMATS:
+            return requested
+        return 'webp' if 'image/webp' in (accept_header or '') else 'jpeg'
+    
+    def source_path(self, filename):
+        """Path of an original image, or None if it does not exist"""
+        path = safe_join(self.source_dir, filename)
+        if path is None or not os.path.isfile(path):
+            return None
+        return path
+    
+    def make_etag(self, stat, *parts):
+        """Strong ETag from the source file version and the variant parameters"""
+        key = '|'.join(str(part) for part in (stat.st_mtime_ns, stat.st_size, *parts))
+        return hashlib.sha1(key.encode()).hexdigest()[:20]
+    
+    def original(self, filename):
+        """(path, etag) for serving the untouched source image"""
+        path = self.source_path(filename)
+        if path is None:
+            return None
+        return path, self.make_etag(os.stat(path), filename)
+    
+    def get_variant(self, filename, width, fmt):
+        """(path, mimetype, etag) of a resized rendition, rendering it on first request"""
+        path = self.source_path(filename)
+        if path is None:
+            return None
+        
+        stat = os.stat(path)
+        width = self.bound_width(width)
+        pil_format, mimetype, options = FORMATS[fmt]
+        
+        # Source mtime is part of the name, so edited images get fresh variants
+        prefix = self.variant_prefix(path)
+        variant_name = f"{prefix}{stat.st_mtime_ns}-w{width}.{fmt}"
+        variant_path = os.path.join(self.cache_dir, variant_name)
+        etag = self.make_etag(stat, filename, width, fmt)
+        
+        if not os.path.exists(variant_path):
+            with self.locks_guard:
+                lock = self.locks.setdefault(variant_name, threading.Lock())
+            with lock:
+                if not os.path.exists(variant_path):
+                    self.render(path, variant_path, width, pil_format, options)
+                    self.prune(prefix, stat.st_mtime_ns)
+        
+        return variant_path, mimetype, etag
+    
+    def variant_prefix(self, path):
+        """Name prefix shared by every variant of one source image"""
+        # The relative path (with extension) is hashed so same-named files in other folders don't collide
+        relative = os.path.relpath(path, self.source_dir).replace(os.sep, '/')
+        stem = os.path.splitext(os.path.basename(path))[0]
+        return f"{stem}-{hashlib.sha1(relative.encode()).hexdigest()[:10]}-"
+    
+    def prune(self, prefix, mtime_ns):
+        """Delete variants rendered from an older version of the source image"""
+        current = f"{prefix}{mtime_ns}-"
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.startswith(prefix) and not entry.name.startswith(current):
+                try:
+                    os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+    
+    def render(self, source, destination, width, pil_format, options):
+        """Resize and encode one variant, writing it atomically"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        
+        with Image.open(source) as image:
+            image.thumbnail((width, width * 10), Image.LANCZOS)
+            if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            
+            # Write to a temp file first so other workers never read a partial image
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    image.save(f, pil_format, **options)
+                os.replace(temp_path, destination)
+            except Exception:
+                os.unlink(temp_path)
+                raise
+
+# Global image variant cache instance
+image_variants = ImageVariantCache()
@@ -0,0 +1,85 @@
+import os
+import time
+from flask import g, request, Response
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge,
+                               Histogram, generate_latest)
+from prometheus_client import multiprocess
+
+# Under gunicorn, gunicorn.conf.py sets PROMETHEUS_MULTIPROC_DIR so every
+# worker writes its samples to a shared directory and /metrics sums them.
+
+REQUEST_LATENCY = Histogram(
+    'debrisense_http_request_duration_seconds', 'Request latency by route',
+    ['method', 'route'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+REQUEST_COUNT = Counter(
+    'debrisense_http_requests_total', 'Requests by route and status',
+    ['method', 'route', 'status'])
+REQUESTS_IN_FLIGHT = Gauge(
+    'debrisense_http_requests_in_flight', 'Requests currently being handled',
+    ['route'], multiprocess_mode='livesum')
+
+WEATHER_API_CALLS = Counter(
+    'debrisense_weather_api_calls_total', 'WeatherAPI requests by endpoint and outcome',
+    ['endpoint', 'outcome'])
+WEATHER_CACHE_LOOKUPS = Counter(
+    'debrisense_weather_cache_lookups_total', 'Weather cache lookups',
+    ['kind', 'result'])
+RATE_LIMIT_WAITS = Counter(
+    'debrisense_weather_rate_limit_waits_total', 'Times a WeatherAPI call waited for the rate limiter')
+RATE_LIMIT_WAIT_SECONDS = Counter(
+    'debrisense_weather_rate_limit_wait_seconds_total', 'Time spent waiting for the rate limiter')
+
+MODEL_PREDICT_SECONDS = Histogram(
+    'debrisense_model_predict_seconds', 'Forest inference time per batch',
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+MODEL_PREDICT_ROWS = Counter(
+    'debrisense_model_predict_rows_total', 'Feature rows run through the forest')
+
+SENSOR_FAILURES = Counter(
+    'debrisense_sensor_failures_total', 'Simulated sensor failures started',
+    ['river', 'sensor'])
+
+RESPONSE_CACHE_LOOKUPS = Counter(
+    'debrisense_response_cache_lookups_total', 'Serialized response cache lookups',
+    ['result'])
+
+ADMISSION_DECISIONS = Counter(
+    'debrisense_admission_decisions_total', 'Admission control outcomes for expensive routes',
+    ['route', 'decision'])
+
+def route_label():
+    """Route template rather than the raw path, to keep label cardinality bounded"""
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+def init_app(app):
+    """Instrument every route and expose /metrics"""
+    
+    @app.before_request
+    def start_request_timer():
+        g.metrics_route = route_label()
+        g.metrics_start = time.perf_counter()
+        REQUESTS_IN_FLIGHT.labels(g.metrics_route).inc()
+    
+    @app.after_request
+    def record_request(response):
+        route = g.get('metrics_route', route_label())
+        REQUEST_COUNT.labels(request.method, route, response.status_code).inc()
+        if 'metrics_start' in g:
+            REQUEST_LATENCY.labels(request.method, route).observe(time.perf_counter() - g.metrics_start)
+        return response
+    
+    @app.teardown_request
+    def end_request(exc):
+        if 'metrics_route' in g:
+            REQUESTS_IN_FLIGHT.labels(g.pop('metrics_route')).dec()
+    
+    @app.route('/metrics')
+    def metrics():
+        """Prometheus text exposition, summed across workers when multiprocess"""
+        if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
@@ -0,0 +1,163 @@
+import contextvars
+import cProfile
+import hmac
+import io
+import json
+import os
+import pstats
+import random
+import re
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from flask import abort, g, request, Response
+
+# Stage timings of the current request; None outside a request, so stages are free there
+current_timings = contextvars.ContextVar('stage_timings', default=None)
+
+PROFILE_HEADER = 'X-Debrisense-Profile'
+
+class RequestProfiler:
+    def __init__(self):
+        # Fraction of requests written to the trace log
+        self.trace_sample_rate = float(os.environ.get('TRACE_SAMPLE_RATE', 0))
+        # Written outside the app directory, which the catch-all static route serves
+        log_dir = os.path.join(tempfile.gettempdir(), 'debrisense-logs')
+        self.trace_log_path = os.environ.get('TRACE_LOG_PATH', os.path.join(log_dir, 'traces.jsonl'))
+        # Per-request cProfile is only available when a token is configured
+        self.profile_token = os.environ.get('PROFILE_TOKEN')
+        self.profile_dir = os.environ.get('PROFILE_DIR', os.path.join(log_dir, 'profiles'))
+        self.trace_lock = threading.Lock()
+    
+    def authorized(self):
+        """Whether the request carries the profile token (compared in constant time)"""
+        if not self.profile_token:
+            return False
+        supplied = request.headers.get(PROFILE_HEADER, '')
+        return hmac.compare_digest(supplied.encode(), self.profile_token.encode())
+    
+    def start(self):
+        """Begin collecting stage timings, and a profile if asked for"""
+        g.stage_token = current_timings.set([])
+        g.request_start = time.perf_counter()
+        
+        if self.authorized():
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                g.profiler = profiler
+            except ValueError:  # Another profiler is already active
+                pass
+    
+    def finish(self, response):
+        """Attach Server-Timing, and save the trace and profile if any"""
+        timings = current_timings.get()
+        if timings is None:
+            return response
+        total_ms = (time.perf_counter() - g.request_start) * 1000
+        
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            response.headers['X-Profile-Id'] = self.save_profile(profiler)
+        
+        response.headers['Server-Timing'] = server_timing(timings, total_ms)
+        
+        if self.trace_sample_rate and random.random() < self.trace_sample_rate:
+            route = request.url_rule.rule if request.url_rule is not None else request.path
+            self.write_trace(request.method, route, request.path, response.status_code, total_ms, timings)
+        
+        return response
+    
+    def teardown(self):
+        """Stop collecting stage timings for this request"""
+        token = g.pop('stage_token', None)
+        if token is not None:
+            current_timings.reset(token)
+    
+    def write_trace(self, method, route, path, status, total_ms, timings):
+        """Append one trace record as a JSON line"""
+        record = {
+            'timestamp': time.time(),
+            'method': method,
+            'route': route,
+            'path': path,
+            'status': status,
+            'total_ms': round(total_ms, 3),
+            'stages': [{'name': name, 'ms': round(duration_ms, 3)} for name, duration_ms in timings]
+        }
+        os.makedirs(os.path.dirname(self.trace_log_path) or '.', exist_ok=True)
+        with self.trace_lock, open(self.trace_log_path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+    
+    def save_profile(self, profiler):
+        """Dump pstats for later inspection, returning its id"""
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        os.makedirs(self.profile_dir, exist_ok=True)
+        profiler.dump_stats(os.path.join(self.profile_dir, f'{profile_id}.prof'))
+        return profile_id
+    
+    def profile_report(self, profile_id, limit=40):
+        """Text summary of a saved profile, sorted by cumulative time"""
+        if not re.fullmatch(r'[\w-]+', profile_id):
+            return None
+        path = os.path.join(self.profile_dir, f'{profile_id}.prof')
+        if not os.path.exists(path):
+            return None
+        output = io.StringIO()
+        pstats.Stats(path, stream=output).sort_stats('cumulative').print_stats(limit)
+        return output.getvalue()
+
+def server_timing(timings, total_ms):
+    """Server-Timing header value for a request's stage timings"""
+    # Repeated stages (e.g. per timeframe) are summed, in first-seen order
+    totals = {}
+    for name, duration_ms in timings:
+        totals[name] = totals.get(name, 0.0) + duration_ms
+    
+    return ', '.join(
+        [f'{name};dur={duration_ms:.2f}' for name, duration_ms in totals.items()] +
+        [f'total;dur={total_ms:.2f}'])
+
+@contextmanager
+def stage(name):
+    """Time a block as one Server-Timing stage of the current request"""
+    timings = current_timings.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.append((name, (time.perf_counter() - start) * 1000))
+
+def init_app(app):
+    """Add stage timing to every request and the profile download route"""
+    
+    @app.before_request
+    def start_profiling():
+        request_profiler.start()
+    
+    @app.after_request
+    def finish_profiling(response):
+        return request_profiler.finish(response)
+    
+    @app.teardown_request
+    def teardown_profiling(exc):
+        request_profiler.teardown()
+    
+    @app.route('/profiles/<profile_id>')
+    def get_profile(profile_id):
+        """Text report of a saved request profile (needs the profile token)"""
+        if not request_profiler.authorized():
+            abort(404)
+        report = request_profiler.profile_report(profile_id)
+        if report is None:
+            abort(404)
+        return Response(report, mimetype='text/plain')
+
+# Global request profiler instance
+request_profiler = RequestProfiler()
@@ -0,0 +1,153 @@
+import gzip
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import g, make_response, request, Response
+from werkzeug.http import parse_accept_header, parse_etags
+
+from metrics import RESPONSE_CACHE_LOOKUPS
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional, gzip is always available
+    brotli = None
+
+class ResponseCache:
+    def __init__(self, max_entries=512, min_compress_size=512):
+        self.max_entries = max_entries
+        self.min_compress_size = min_compress_size  # Smaller bodies are sent as-is
+        self.entries = OrderedDict()  # key -> serialized response, least recently used first
+        self.lock = threading.Lock()
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'not_modified': 0
+        }
+    
+    def bypass(self):
+        """Keep the current response out of the cache (e.g. an upstream error)"""
+        g.response_cache_bypass = True
+    
+    def set_version(self, version):
+        """Store the current response under this version, the one the view actually read"""
+        g.response_cache_version = version
+    
+    def build_entry(self, body, mimetype, version):
+        """Serialize once: body, ETag and compressed variants"""
+        entry = {
+            'version': version,
+            'created': time.time(),
+            'mimetype': mimetype,
+            'etag': hashlib.sha1(body).hexdigest(),
+            'bodies': {'identity': body}
+        }
+        
+        if len(body) >= self.min_compress_size:
+            entry['bodies']['gzip'] = gzip.compress(body, compresslevel=6)
+            if brotli is not None:
+                entry['bodies']['br'] = brotli.compress(body, quality=5)
+        
+        return entry
+    
+    def choose_encoding(self, entry, accept_encodings=None):
+        """Best encoding the client accepts, preferring brotli"""
+        if accept_encodings is None:
+            accept_encodings = request.accept_encodings
+        for encoding in ('br', 'gzip'):
+            if encoding in entry['bodies'] and accept_encodings[encoding] > 0:
+                return encoding
+        return 'identity'
+    
+    def render(self, entry, hit, if_none_match=None, accept_encoding=None):
+        """Status, headers and body for a cache entry given the raw request headers
+        
+        Shared by the Flask and ASGI paths; 304 when the client's copy is current.
+        """
+        headers = [('ETag', f'"{entry["etag"]}"')]
+        if parse_etags(if_none_match).contains(entry['etag']):
+            with self.lock:
+                self.stats['not_modified'] += 1
+            return 304, headers, b''
+        
+        encoding = self.choose_encoding(entry, parse_accept_header(accept_encoding))
+        headers += [('Content-Type', entry['mimetype']), ('Vary', 'Accept-Encoding'),
+                    ('X-Cache', 'HIT' if hit else 'MISS')]
+        if encoding != 'identity':
+            headers.append(('Content-Encoding', encoding))
+        return 200, headers, entry['bodies'][encoding]
+    
+    def serve(self, entry, hit):
+        """Answer the current Flask request from a cache entry"""
+        status, headers, body = self.render(entry, hit, request.headers.get('If-None-Match'),
+                                            request.headers.get('Accept-Encoding'))
+        return Response(body, status=status, headers=headers)
+    
+    def cached(self, version=None, ttl=None):
+        """Cache a GET view's serialized output until version(**view_args) changes or ttl expires"""
+        def decorator(view):
+            @wraps(view)
+            def wrapper(**view_args):
+                key = (request.path, tuple(sorted(request.args.items(multi=True))))
+                current_version = version(**view_args) if version else None
+                
+                entry = self.lookup(key, current_version, ttl)
+                if entry is not None:
+                    return self.serve(entry, hit=True)
+                
+                result = view(**view_args)
+                response = make_response(result)
+                
+                # Only plain successful responses are worth keeping
+                if response.status_code != 200 or response.is_streamed or g.get('response_cache_bypass'):
+                    return response
+                
+                # The view may have fetched the data the version describes, so re-read it
+                if 'response_cache_version' in g:
+                    current_version = g.pop('response_cache_version')
+                elif version:
+                    current_version = version(**view_args)
+                entry = self.store(key, response.get_data(), response.mimetype, current_version)
+                return self.serve(entry, hit=False)
+            return wrapper
+        return decorator
+    
+    def lookup(self, key, version, ttl=None):
+        """Entry for key if it matches version and is younger than ttl, else None"""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry['version'] == version and \
+                    (ttl is None or now - entry['created'] < ttl):
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+            else:
+                entry = None
+                self.stats['misses'] += 1
+        
+        RESPONSE_CACHE_LOOKUPS.labels('hit' if entry is not None else 'miss').inc()
+        return entry
+    
+    def peek(self, key):
+        """Entry for key whatever its version or age (a stale answer beats none under overload)"""
+        with self.lock:
+            return self.entries.get(key)
+    
+    def store(self, key, body, mimetype, version):
+        """Serialize a response body into the cache, evicting the least recently used"""
+        entry = self.build_entry(body, mimetype, version)
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
+    
+    def clear(self):
+        """Drop every cached response"""
+        with self.lock:
+            self.entries.clear()
+
+# Global response cache instance
+response_cache = ResponseCache()
@@ -5,6 +5,9 @@ from datetime import datetime, timedelta
 import json
 import os
 
+from metrics import SENSOR_FAILURES
+from tide_system import tide_engine
+
 class MockSensorSystem:
     def __init__(self):
         self.sensors = {
@@ -41,6 +44,14 @@ class MockSensorSystem:
         """Simulate Malaysian tidal patterns (2 high/2 low tides per day)"""
         if not self.sensors[river_name]['is_coastal']:
             return 0
+        
+        # Stations with harmonic constituents read their precomputed tide table,
+        # scaled by the largest possible deviation into the same -0.6..1.0 range
+        if tide_engine.has_station(river_name):
+            station = tide_engine.stations[river_name]
+            level = float(tide_engine.level_at(river_name, timestamp.timestamp()))
+            max_deviation = sum(c['amplitude'] for c in station['constituents'].values())
+            return (level - station['mean_level']) / max_deviation * 0.8 + 0.2
             
         # Malaysian tidal cycle (approximately 12.4 hours)
         tidal_period = 12.4 * 3600  # seconds
@@ -79,6 +90,8 @@ class MockSensorSystem:
         
         # 2% chance of sensor failure per update
         if random.random() < 0.02:
+            if not sensor['last_failure']:
+                SENSOR_FAILURES.labels(river_name, sensor_type).inc()
             sensor['last_failure'] = now
             sensor['failure_duration'] = random.randint(5, 30)  # 5-30 minutes
         
@@ -138,8 +151,11 @@ class MockSensorSystem:
         if self.simulate_sensor_failure(river_name, 'tide_level'):
             return None
             
-        tidal_factor = self.get_tidal_factor(river_name, timestamp)
-        tide_level = 1.5 + tidal_factor * 1.0  # Base 1.5m ± 1.0m
+        if tide_engine.has_station(river_name):
+            tide_level = float(tide_engine.level_at(river_name, timestamp.timestamp()))
+        else:
+            tidal_factor = self.get_tidal_factor(river_name, timestamp)
+            tide_level = 1.5 + tidal_factor * 1.0  # Base 1.5m ± 1.0m
         
         return round(tide_level, 2)
     
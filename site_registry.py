@@ -0,0 +1,135 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+
+from sensor_system import sensor_system
+
+EARTH_RADIUS_KM = 6371.0088
+
+class SiteRegistry:
+    def __init__(self, csv_path='data/data.csv', sensors=None):
+        self.csv_path = csv_path
+        self.sensors = sensors if sensors is not None else {}
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.version = 0  # Bumped whenever the catalog is rebuilt
+        # (sites, names, coordinates, tree), replaced as a whole so readers never mix two loads
+        self.index = None
+        self.columns = None  # (version, {column: list}) for the catalog rows
+    
+    def load(self):
+        """Build the site catalog and its geo index from the CSV and sensor sites"""
+        sites = pd.read_csv(self.csv_path)
+        sites['source'] = 'catalog'
+        
+        # Sensor stations not in the CSV still need to be findable
+        missing = [(name, info) for name, info in self.sensors.items() if name not in set(sites['name'])]
+        extra = [{
+            'id': len(sites) + i + 1,
+            'latitude': info['coordinates'][0],
+            'longitude': info['coordinates'][1],
+            'name': name,
+            'source': 'sensor'
+        } for i, (name, info) in enumerate(missing)]
+        if extra:
+            sites = pd.concat([sites, pd.DataFrame(extra)], ignore_index=True)
+        
+        coordinates = sites[['latitude', 'longitude']].to_numpy(dtype=np.float64)
+        
+        # Haversine ball tree works on (lat, lng) in radians
+        tree = BallTree(np.radians(coordinates), metric='haversine')
+        self.index = (sites, sites['name'].to_numpy(), coordinates, tree)
+    
+    def refresh(self):
+        """Reload the catalog if the CSV changed on disk"""
+        mtime = os.path.getmtime(self.csv_path)
+        if mtime == self.mtime:
+            return False
+        
+        with self.lock:
+            if mtime != self.mtime:
+                self.load()
+                self.mtime = mtime
+                self.version += 1
+        return True
+    
+    def current_version(self):
+        """Catalog version, after picking up any CSV change"""
+        self.refresh()
+        return self.version
+    
+    def locations(self):
+        """(name, (lat, lng)) for every site, catalog and sensor-only"""
+        self.refresh()
+        _, names, coordinates, _ = self.index
+        return [(name, (float(lat), float(lng))) for name, (lat, lng) in zip(names, coordinates)]
+    
+    def catalog(self):
+        """Rows that came from the CSV catalog, with all their fields"""
+        self.refresh()
+        sites = self.index[0]
+        return sites[sites['source'] == 'catalog']
+    
+    def catalog_columns(self):
+        """Catalog rows as plain-Python column lists sorted by id, built once per version"""
+        version = self.current_version()
+        if self.columns is None or self.columns[0] != version:
+            catalog = self.catalog().sort_values('id')
+            self.columns = (version, {column: catalog[column].tolist() for column in catalog.columns})
+        return self.columns[1]
+    
+    def site_record(self, sites, index, distance_km=None):
+        """One site as a plain dict"""
+        row = sites.iloc[index]
+        record = {
+            'id': int(row['id']),
+            'name': row['name'],
+            'lat': float(row['latitude']),
+            'lng': float(row['longitude']),
+            'source': row['source']
+        }
+        if pd.notna(row.get('pollution_level')):
+            record['pollution_level'] = float(row['pollution_level'])
+        if distance_km is not None:
+            record['distance_km'] = round(float(distance_km), 3)
+        return record
+    
+    def find(self, river_name):
+        """Case-insensitive partial name match, first match wins"""
+        self.refresh()
+        sites = self.index[0]
+        matches = np.flatnonzero(sites['name'].str.contains(river_name, case=False, na=False, regex=False))
+        if len(matches) == 0:
+            return None
+        return self.site_record(sites, matches[0])
+    
+    def nearest(self, lat, lng, k=1):
+        """The k sites closest to a point, nearest first"""
+        self.refresh()
+        sites, names, _, tree = self.index
+        k = max(1, min(int(k), len(names)))
+        distances, indices = tree.query(np.radians([[lat, lng]]), k=k)
+        return [self.site_record(sites, i, d * EARTH_RADIUS_KM) for d, i in zip(distances[0], indices[0])]
+    
+    def within_radius(self, lat, lng, radius_km):
+        """All sites within radius_km of a point, nearest first"""
+        self.refresh()
+        sites, _, _, tree = self.index
+        indices, distances = tree.query_radius(
+            np.radians([[lat, lng]]), r=radius_km / EARTH_RADIUS_KM, return_distance=True, sort_results=True)
+        return [self.site_record(sites, i, d * EARTH_RADIUS_KM) for d, i in zip(distances[0], indices[0])]
+    
+    def snap(self, lat, lng, max_distance_km):
+        """Coordinates of the nearest site if it is within max_distance_km"""
+        self.refresh()
+        _, _, coordinates, tree = self.index
+        distances, indices = tree.query(np.radians([[lat, lng]]), k=1)
+        if distances[0][0] * EARTH_RADIUS_KM > max_distance_km:
+            return None
+        latitude, longitude = coordinates[indices[0][0]]
+        return float(latitude), float(longitude)
+
+# Global site registry instance
+site_registry = SiteRegistry(sensors=sensor_system.sensors)
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+import numpy as np
+
+# Angular speeds of the main tidal constituents, degrees per hour
+CONSTITUENT_SPEEDS = {
+    'M2': 28.9841042,  # Principal lunar semidiurnal
+    'S2': 30.0,        # Principal solar semidiurnal
+    'N2': 28.4397295,  # Larger lunar elliptic semidiurnal
+    'K1': 15.0410686,  # Lunisolar diurnal
+    'O1': 13.9430356   # Lunar diurnal
+}
+
+class TideEngine:
+    def __init__(self, config_path='data/tide_stations.json', table_dir='data/tide_tables'):
+        with open(config_path) as f:
+            config = json.load(f)
+        self.stations = config['stations']
+        self.step_seconds = config.get('step_minutes', 1) * 60
+        self.span_days = config.get('span_days', 400)  # A year plus room for forecast horizons
+        self.table_dir = table_dir
+        self.extreme_step_seconds = 600  # High/low waters are located on this grid, then refined
+        self.tables = {}  # (station, start epoch) -> (start epoch, memmapped float32 levels)
+        self.lock = threading.Lock()
+        self.build_locks = {}  # One lock per table so building one doesn't block the others
+    
+    def has_station(self, station):
+        return station in self.stations
+    
+    def table_signature(self, station):
+        """Hash of what a table was built from, so edited constituents rebuild it"""
+        settings = {'station': self.stations[station], 'step': self.step_seconds, 'span': self.span_days}
+        return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:12]
+    
+    def table_start(self, epoch):
+        """Tables start at 00:00 UTC on 1 January of the year containing epoch"""
+        year = datetime.fromtimestamp(epoch, tz=timezone.utc).year
+        return datetime(year, 1, 1, tzinfo=timezone.utc).timestamp()
+    
+    def table_prefix(self, station):
+        return f"{station.lower().replace(' ', '_')}-"
+    
+    def table_path(self, station, start):
+        name = f"{self.table_prefix(station)}{int(start)}-{self.table_signature(station)}.npy"
+        return os.path.join(self.table_dir, name)
+    
+    def table_starts(self, now=None):
+        """Start epochs of the tables kept on disk: the current and the next year"""
+        current = self.table_start(now if now is not None else time.time())
+        return current, self.table_start(current + 366 * 86400)
+    
+    def harmonic_levels(self, station, epochs):
+        """Sum of the station's constituents at the given epoch seconds"""
+        info = self.stations[station]
+        hours = (np.asarray(epochs, dtype=np.float64) - 946728000.0) / 3600  # Hours since J2000
+        levels = np.full(hours.shape, float(info['mean_level']))
+        for name, constituent in info['constituents'].items():
+            angle = np.radians(CONSTITUENT_SPEEDS[name] * hours - constituent['phase'])
+            levels += constituent['amplitude'] * np.cos(angle)
+        return levels
+    
+    def build_table(self, station, start, path):
+        """Evaluate the harmonics once per step for the whole span and write them to disk"""
+        count = int(self.span_days * 86400 // self.step_seconds)
+        os.makedirs(self.table_dir, exist_ok=True)
+        
+        # Written under a temporary name so readers never map a partial table
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        table = np.lib.format.open_memmap(temp_path, mode='w+', dtype=np.float32, shape=(count,))
+        chunk = 86400 * 30 // self.step_seconds  # A month at a time keeps float64 scratch small
+        for i in range(0, count, chunk):
+            epochs = start + np.arange(i, min(i + chunk, count), dtype=np.float64) * self.step_seconds
+            table[i:i + len(epochs)] = self.harmonic_levels(station, epochs)
+        table.flush()
+        del table
+        os.replace(temp_path, path)
+    
+    def prune_tables(self, station, keep):
+        """Delete this station's table files other than the paths in keep"""
+        prefix = self.table_prefix(station)
+        for name in os.listdir(self.table_dir):
+            path = os.path.join(self.table_dir, name)
+            if name.startswith(prefix) and name.endswith('.npy') and path not in keep:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+    
+    def get_table(self, station, epoch):
+        """(start epoch, levels) for the table covering epoch, building it on first use
+        
+        Only the current and next year have tables; None for any other year.
+        """
+        start = self.table_start(epoch)
+        key = (station, start)
+        cached = self.tables.get(key)
+        if cached is not None:
+            return cached
+        
+        starts = self.table_starts()
+        if start not in starts:
+            return None
+        
+        with self.lock:
+            lock = self.build_locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self.tables:
+                path = self.table_path(station, start)
+                if not os.path.exists(path):
+                    self.build_table(station, start, path)
+                    self.prune_tables(station, {self.table_path(station, s) for s in starts})
+                self.tables[key] = (start, np.load(path, mmap_mode='r'))
+        return self.tables[key]
+    
+    def level_at(self, station, epochs):
+        """Tide level at each epoch second, interpolated between table steps"""
+        epochs = np.asarray(epochs, dtype=np.float64)
+        if not epochs.size:
+            return self.harmonic_levels(station, epochs)
+        cached = self.get_table(station, float(np.min(epochs)))
+        if cached is None:
+            # Outside the tabled years: evaluate the harmonics directly
+            return self.harmonic_levels(station, epochs)
+        start, table = cached
+        
+        position = (epochs - start) / self.step_seconds
+        inside = (position >= 0) & (position < len(table) - 1)
+        if not np.all(inside):
+            # Past the end of the table (a query spanning the year boundary): evaluate directly
+            levels = self.harmonic_levels(station, epochs)
+            if np.any(inside):
+                levels[inside] = self.level_at(station, epochs[inside])
+            return levels
+        
+        index = position.astype(np.int64)
+        fraction = position - index
+        return table[index] * (1 - fraction) + table[index + 1] * fraction
+    
+    def levels(self, station, start, end, step_seconds=600):
+        """(epochs, levels) from start to end inclusive every step_seconds"""
+        epochs = np.arange(start, end + step_seconds / 2, step_seconds, dtype=np.float64)
+        return epochs, self.level_at(station, epochs)
+    
+    def extremes(self, station, start, end):
+        """High and low waters between start and end as (epochs, levels, is_high)"""
+        # Turning points are found on a coarse grid aligned to the table steps, with one
+        # coarse step of margin on each side so those at the edges are found
+        coarse = self.extreme_step_seconds
+        origin = np.floor((start - coarse) / self.step_seconds) * self.step_seconds
+        epochs, levels = self.levels(station, origin, end + coarse, coarse)
+        slope = np.diff(levels)
+        highs = (slope[:-1] > 0) & (slope[1:] <= 0)
+        lows = (slope[:-1] < 0) & (slope[1:] >= 0)
+        turning = np.flatnonzero(highs | lows) + 1
+        is_high = highs[turning - 1]
+        
+        # Then refined to table resolution within one coarse step either side
+        offsets = np.arange(-coarse, coarse + self.step_seconds / 2, self.step_seconds)
+        fine_epochs = epochs[turning][:, np.newaxis] + offsets
+        fine_levels = self.level_at(station, fine_epochs.ravel()).reshape(fine_epochs.shape)
+        pick = np.where(is_high, fine_levels.argmax(axis=1), fine_levels.argmin(axis=1))
+        rows = np.arange(len(turning))
+        extreme_epochs, extreme_levels = fine_epochs[rows, pick], fine_levels[rows, pick]
+        
+        inside = (extreme_epochs >= start) & (extreme_epochs <= end)
+        return extreme_epochs[inside], extreme_levels[inside], is_high[inside]
+    
+    def summary(self, station, start, end, extremes=None):
+        """Lowest, highest and mean level between start and end
+        
+        The mean comes from the coarse grid; the bounds also take the high and
+        low waters (pass extremes() to reuse them) and the range end points.
+        """
+        _, levels = self.levels(station, start, end, self.extreme_step_seconds)
+        _, extreme_levels, _ = extremes if extremes is not None else self.extremes(station, start, end)
+        bounds = np.concatenate((levels, extreme_levels, self.level_at(station, [start, end])))
+        return {
+            'min': round(float(bounds.min()), 3),
+            'max': round(float(bounds.max()), 3),
+            'mean': round(float(levels.mean()), 3)
+        }
+    
+    def window_features(self, station, timeframe_hours, now=None):
+        """Predicted tide at the horizon and the highest water before it"""
+        now = now if now is not None else datetime.now().timestamp()
+        end = now + timeframe_hours * 3600
+        _, levels = self.levels(station, now, end, self.step_seconds * 10)
+        return {
+            'forecast_tide_level': float(levels[-1]),
+            'forecast_tide_max': float(levels.max())
+        }
+
+# Global tide engine instance
+tide_engine = TideEngine(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'tide_stations.json'),
+                         os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'tide_tables'))
@@ -0,0 +1,334 @@
+import hashlib
+import json
+import math
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from site_registry import site_registry, EARTH_RADIUS_KM
+from fleet_refresh import fleet_refresher
+
+try:
+    from PIL import Image
+except ImportError:  # Without Pillow the tile layers are unavailable
+    Image = None
+
+TILE_SIZE = 256
+GRID_SIZE = 64  # Interpolated per tile at this resolution, then smoothly upscaled
+MAX_ZOOM = 16
+
+# Value -> colour ramp shared by every layer (fraction of the layer's max_value)
+COLOR_STOPS = np.array([0.0, 0.3, 0.45, 0.7, 0.85, 1.0])
+COLORS = np.array([
+    [46, 204, 113],   # very low
+    [241, 196, 15],   # low
+    [243, 156, 18],   # medium
+    [231, 76, 60],    # high
+    [192, 57, 43],    # critical
+    [120, 20, 60]
+], dtype=np.float64)
+
+LAYERS = {
+    'pollution': {'max_value': 350},  # Site pollution_level from the catalog
+    'debris': {'max_value': 350}      # 24h predicted debris level from the fleet snapshot
+}
+
+class TileRenderer:
+    def __init__(self, cache_dir='data/tiles'):
+        self.cache_dir = cache_dir
+        self.radius_km = float(os.environ.get('TILE_RADIUS_KM', 60))  # Sites influence pixels this close
+        self.power = 2  # Inverse-distance weighting exponent
+        self.max_age = int(os.environ.get('TILE_CACHE_MAX_AGE', 300))
+        self.inputs = {}  # layer -> (source version, {site: (lat, lng, value)})
+        self.lock = threading.Lock()
+        self.render_locks = {}  # One lock per tile so it is only rendered once
+        self.render_locks_guard = threading.Lock()
+        # Re-rendering after an input change runs here, off the request and publish threads
+        self.sync_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tile-sync')
+        self.sync_pending = set()
+        self.blank_path = os.path.join(cache_dir, 'blank.png')  # Shared by tiles with no site in reach
+    
+    @property
+    def enabled(self):
+        return Image is not None
+    
+    def source_version(self, layer):
+        """Version of the data behind a layer, cheap to read on every request"""
+        if layer == 'pollution':
+            return site_registry.current_version()
+        return fleet_refresher.version
+    
+    def layer_points(self, layer):
+        """{site: (lat, lng, value)} for every site with a value in this layer"""
+        points = {}
+        if layer == 'pollution':
+            columns = site_registry.catalog_columns()
+            for name, lat, lng, value in zip(columns['name'], columns['latitude'], columns['longitude'],
+                                             columns['pollution_level']):
+                if value is not None and not math.isnan(value):
+                    points[name] = (float(lat), float(lng), float(value))
+        else:
+            # Read after source_version(), so the version recorded for these points is never newer
+            _, snapshot = fleet_refresher.current()
+            if snapshot is None:
+                return points
+            locations = dict(site_registry.locations())
+            for name, entry in snapshot['rivers'].items():
+                prediction = entry['predictions'].get('24h', {}).get('prediction')
+                if prediction is not None and name in locations:
+                    points[name] = (*locations[name], float(prediction))
+        return points
+    
+    def layer_dir(self, layer):
+        return os.path.join(self.cache_dir, layer)
+    
+    def tile_path(self, layer, z, x, y):
+        return os.path.join(self.layer_dir(layer), str(z), str(x), f'{y}.png')
+    
+    def manifest_path(self, layer):
+        return os.path.join(self.layer_dir(layer), 'manifest.json')
+    
+    def load_manifest(self, layer):
+        """Site values the tiles on disk were rendered from, or None"""
+        try:
+            with open(self.manifest_path(layer)) as f:
+                return {name: tuple(point) for name, point in json.load(f).items()}
+        except (OSError, ValueError):
+            return None
+    
+    def save_manifest(self, layer, points):
+        os.makedirs(self.layer_dir(layer), exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=self.layer_dir(layer), delete=False, suffix='.tmp') as f:
+            json.dump(points, f)
+        os.replace(f.name, self.manifest_path(layer))
+    
+    def sync(self, layer):
+        """Pick up changed inputs, re-rendering only the cached tiles near changed sites"""
+        version = self.source_version(layer)
+        current = self.inputs.get(layer)
+        if current is not None and current[0] == version:
+            return 0
+        
+        with self.lock:
+            current = self.inputs.get(layer)
+            if current is not None and current[0] == version:
+                return 0
+            
+            points = self.layer_points(layer)
+            previous = current[1] if current is not None else self.load_manifest(layer)
+            # New tiles use the new inputs while the cached ones around changed sites are redone
+            self.inputs[layer] = (version, points)
+            if previous is None:
+                # Tiles on disk were rendered from unknown inputs
+                shutil.rmtree(self.layer_dir(layer), ignore_errors=True)
+                rerendered = 0
+            else:
+                changed = [points.get(name) or previous.get(name)
+                           for name in set(points) | set(previous) if points.get(name) != previous.get(name)]
+                rerendered = self.rerender_near(layer, changed, points)
+            
+            self.save_manifest(layer, points)
+            return rerendered
+    
+    def request_sync(self, layer):
+        """Sync a layer on the background thread unless a sync is already queued"""
+        with self.render_locks_guard:
+            if layer in self.sync_pending:
+                return
+            self.sync_pending.add(layer)
+        self.sync_executor.submit(self.background_sync, layer)
+    
+    def background_sync(self, layer):
+        with self.render_locks_guard:
+            self.sync_pending.discard(layer)  # A change from now on queues another sync
+        try:
+            self.sync(layer)
+        except Exception as e:
+            print(f"Tile sync error for {layer}: {e}")
+    
+    def reach(self, lat):
+        """Degrees of latitude and longitude the influence radius spans around latitude lat"""
+        dlat = math.degrees(self.radius_km / EARTH_RADIUS_KM)
+        return dlat, dlat / max(math.cos(math.radians(min(abs(lat) + dlat, 89.0))), 0.01)
+    
+    def tile_range(self, z, lat, lng):
+        """(x0, x1, y0, y1) inclusive tile bounds within the influence radius of a point at zoom z"""
+        dlat, dlng = self.reach(lat)
+        x0, y0 = self.tile_of(z, min(lat + dlat, 85.0), lng - dlng)
+        x1, y1 = self.tile_of(z, max(lat - dlat, -85.0), lng + dlng)
+        return x0, x1, y0, y1
+    
+    def tile_bounds(self, z, x, y):
+        """(south, north, west, east) of a tile in degrees"""
+        n = 2 ** z
+        north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+        south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+        return south, north, x / n * 360 - 180, (x + 1) / n * 360 - 180
+    
+    def points_near(self, z, x, y, points):
+        """The points whose influence radius can reach a tile"""
+        south, north, west, east = self.tile_bounds(z, x, y)
+        dlat, dlng = self.reach(max(abs(south), abs(north)))
+        return {name: point for name, point in points.items()
+                if south - dlat <= point[0] <= north + dlat and west - dlng <= point[1] <= east + dlng}
+    
+    def cached_tiles(self, layer):
+        """{z: (xs, ys)} arrays of the tiles on disk, listed once"""
+        tiles = {}
+        layer_dir = self.layer_dir(layer)
+        for z_name in os.listdir(layer_dir):
+            if not z_name.isdigit():
+                continue
+            xs, ys = [], []
+            for x_name in os.listdir(os.path.join(layer_dir, z_name)):
+                for y_name in os.listdir(os.path.join(layer_dir, z_name, x_name)):
+                    if y_name.endswith('.png'):
+                        xs.append(int(x_name))
+                        ys.append(int(y_name[:-4]))
+            if xs:
+                tiles[int(z_name)] = (np.array(xs), np.array(ys))
+        return tiles
+    
+    def tile_of(self, z, lat, lng):
+        """Web mercator tile containing a point"""
+        n = 2 ** z
+        x = int((lng + 180) / 360 * n)
+        y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+        return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+    
+    def rerender_near(self, layer, changed, points):
+        """Re-render cached tiles within reach of the changed sites"""
+        layer_dir = self.layer_dir(layer)
+        if not changed or not os.path.isdir(layer_dir):
+            return 0
+        
+        tiles = []
+        for z, (xs, ys) in self.cached_tiles(layer).items():
+            bounds = np.array([self.tile_range(z, lat, lng) for lat, lng, _ in changed])
+            hit = np.zeros(len(xs), dtype=bool)
+            # Cached tiles against the changed sites' reach, in blocks to bound the matrix
+            for start in range(0, len(bounds), 256):
+                x0, x1, y0, y1 = bounds[start:start + 256].T[:, None, :]
+                hit |= ((xs[:, None] >= x0) & (xs[:, None] <= x1) &
+                        (ys[:, None] >= y0) & (ys[:, None] <= y1)).any(axis=1)
+            tiles.extend((z, int(x), int(y)) for x, y in zip(xs[hit], ys[hit]))
+        
+        for z, x, y in tiles:
+            self.render(layer, z, x, y, points)
+        return len(tiles)
+    
+    def pixel_coordinates(self, z, x, y, size):
+        """Latitude and longitude of each pixel centre of a size x size tile grid"""
+        n = 2 ** z
+        offsets = (np.arange(size) + 0.5) / size
+        lng = (x + offsets) / n * 360 - 180
+        lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + offsets) / n))))
+        return np.meshgrid(lat, lng, indexing='ij')
+    
+    def interpolate(self, lat, lng, points):
+        """Inverse-distance weighted values and distance to the nearest site for each pixel"""
+        site_coordinates = np.radians(np.array([(p[0], p[1]) for p in points.values()], dtype=np.float64))
+        values = np.array([p[2] for p in points.values()], dtype=np.float64)
+        pixel_lat = np.radians(lat.ravel())[:, None]
+        pixel_lng = np.radians(lng.ravel())[:, None]
+        
+        numerator = np.zeros(pixel_lat.shape[0])
+        denominator = np.zeros(pixel_lat.shape[0])
+        nearest = np.full(pixel_lat.shape[0], np.inf)
+        
+        # Sites are processed in blocks to bound the (pixels, sites) distance matrix
+        for start in range(0, len(values), 256):
+            site_lat = site_coordinates[start:start + 256, 0][None, :]
+            site_lng = site_coordinates[start:start + 256, 1][None, :]
+            a = np.sin((site_lat - pixel_lat) / 2) ** 2 + \
+                np.cos(pixel_lat) * np.cos(site_lat) * np.sin((site_lng - pixel_lng) / 2) ** 2
+            distance = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+            
+            weights = np.where(distance <= self.radius_km, 1 / np.maximum(distance, 0.01) ** self.power, 0.0)
+            numerator += weights @ values[start:start + 256]
+            denominator += weights.sum(axis=1)
+            nearest = np.minimum(nearest, distance.min(axis=1))
+        
+        with np.errstate(invalid='ignore', divide='ignore'):
+            surface = np.where(denominator > 0, numerator / denominator, 0.0)
+        return surface.reshape(lat.shape), nearest.reshape(lat.shape)
+    
+    def colorize(self, layer, surface, nearest):
+        """RGBA pixels: colour from the value, fading out towards the edge of the radius"""
+        fraction = np.clip(surface / LAYERS[layer]['max_value'], 0, 1)
+        rgba = np.empty(surface.shape + (4,), dtype=np.uint8)
+        for channel in range(3):
+            rgba[..., channel] = np.interp(fraction, COLOR_STOPS, COLORS[:, channel])
+        rgba[..., 3] = (170 * np.clip(1 - nearest / self.radius_km, 0, 1) ** 0.5).astype(np.uint8)
+        return rgba
+    
+    def render(self, layer, z, x, y, points):
+        """Interpolate, colour and write one tile atomically
+        
+        Returns False, and writes nothing, when no site reaches the tile; a
+        previously rendered tile there is removed.
+        """
+        path = self.tile_path(layer, z, x, y)
+        points = self.points_near(z, x, y, points)
+        rgba = None
+        if points:
+            lat, lng = self.pixel_coordinates(z, x, y, GRID_SIZE)
+            surface, nearest = self.interpolate(lat, lng, points)
+            if nearest.min() < self.radius_km:
+                rgba = self.colorize(layer, surface, nearest)
+        
+        if rgba is None:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            return False
+        
+        image = Image.fromarray(rgba, 'RGBA').resize((TILE_SIZE, TILE_SIZE), Image.BILINEAR)
+        self.write_png(image, path)
+        return True
+    
+    def write_png(self, image, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            image.save(f, 'PNG', optimize=True)
+        os.replace(temp_path, path)
+    
+    def blank_tile(self):
+        """(path, etag) of the one transparent tile served wherever no site reaches"""
+        if not os.path.exists(self.blank_path):
+            self.write_png(Image.new('RGBA', (TILE_SIZE, TILE_SIZE), (0, 0, 0, 0)), self.blank_path)
+        return self.blank_path, 'blank'
+    
+    def get_tile(self, layer, z, x, y):
+        """(path, etag) of a tile, rendering it on first request; None when out of range"""
+        if layer not in LAYERS or not 0 <= z <= MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            return None
+        
+        if layer not in self.inputs:
+            self.sync(layer)
+        elif self.inputs[layer][0] != self.source_version(layer):
+            self.request_sync(layer)  # Cached tiles are served until it catches up
+        path = self.tile_path(layer, z, x, y)
+        
+        if not os.path.exists(path):
+            key = (layer, z, x, y)
+            with self.render_locks_guard:
+                lock = self.render_locks.setdefault(key, threading.Lock())
+            with lock:
+                rendered = os.path.exists(path) or self.render(layer, z, x, y, self.inputs[layer][1])
+            with self.render_locks_guard:
+                self.render_locks.pop(key, None)
+            if not rendered:
+                return self.blank_tile()
+        
+        stat = os.stat(path)
+        etag = hashlib.sha1(f'{path}:{stat.st_mtime_ns}:{stat.st_size}'.encode()).hexdigest()
+        return path, etag
+
+# Global tile renderer instance
+tile_renderer = TileRenderer()
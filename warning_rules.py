@@ -0,0 +1,205 @@
+import json
+import os
+import time
+from datetime import datetime
+import numpy as np
+
+from tide_system import tide_engine
+
+# Comparison operators allowed in rule definitions
+OPERATORS = {
+    '>': np.greater,
+    '>=': np.greater_equal,
+    '<': np.less,
+    '<=': np.less_equal,
+    '==': np.equal
+}
+
+# Fields available in the river x time-step matrices
+FIELDS = ('rainfall', 'rainfall_rate', 'wind_speed', 'humidity', 'tide_level')
+
+class WarningRuleEngine:
+    def __init__(self, config):
+        self.step_hours = config.get('step_hours', 1)
+        
+        # Levels sorted by score so a score maps to a level with one searchsorted
+        levels = sorted(config['levels'], key=lambda level: level['min_score'])
+        self.level_names = [level['name'] for level in levels]
+        self.level_scores = np.array([level['min_score'] for level in levels], dtype=np.float64)
+        
+        self.rules = [self.compile_rule(rule) for rule in config['rules']]
+        self.current_levels = {}  # Last published level index per site
+    
+    @classmethod
+    def from_file(cls, path):
+        """Load rule definitions from a JSON config file"""
+        with open(path) as f:
+            return cls(json.load(f))
+    
+    def compile_rule(self, rule):
+        """Turn one rule definition into a function over (sites, steps) matrices"""
+        field = rule['field']
+        if field not in FIELDS:
+            raise ValueError(f"Unknown field '{field}' in rule '{rule['name']}'")
+        if rule['op'] not in OPERATORS:
+            raise ValueError(f"Unknown operator '{rule['op']}' in rule '{rule['name']}'")
+        
+        compare = OPERATORS[rule['op']]
+        value = rule['value']
+        steps = int(rule.get('steps', 1))
+        if steps < 1:
+            raise ValueError(f"Rule '{rule['name']}' needs steps >= 1")
+        rule_type = rule.get('type', 'threshold')
+        
+        if rule_type == 'threshold':
+            def evaluate(fields):
+                return compare(fields[field], value)
+        
+        elif rule_type == 'rate':
+            # Change per hour over the last `steps` steps; no history means no trigger
+            hours = steps * self.step_hours
+            
+            def evaluate(fields):
+                values = fields[field]
+                change = np.full(values.shape, np.nan)
+                change[:, steps:] = (values[:, steps:] - values[:, :-steps]) / hours
+                return compare(change, value)
+        
+        elif rule_type == 'sustained':
+            # Condition held for `steps` consecutive steps, via a running count
+            def evaluate(fields):
+                held = compare(fields[field], value)
+                counts = np.cumsum(held, axis=1)
+                window = counts.copy()
+                window[:, steps:] -= counts[:, :-steps]
+                window[:, :steps - 1] = 0
+                return window >= steps
+        
+        else:
+            raise ValueError(f"Unknown rule type '{rule_type}' in rule '{rule['name']}'")
+        
+        return {
+            'name': rule['name'],
+            'score': rule['score'],
+            'evaluate': evaluate
+        }
+    
+    def evaluate(self, fields):
+        """Evaluate every rule over (sites, steps) matrices in one pass"""
+        shape = np.shape(next(iter(fields.values())))
+        fields = {name: np.asarray(fields.get(name, np.full(shape, np.nan)), dtype=np.float64)
+                  for name in FIELDS}
+        
+        triggered = {}
+        scores = np.zeros(shape, dtype=np.float64)
+        for rule in self.rules:
+            mask = rule['evaluate'](fields)
+            triggered[rule['name']] = mask
+            scores += mask * rule['score']
+        
+        levels = np.searchsorted(self.level_scores, scores, side='right') - 1
+        
+        return {
+            'scores': scores,
+            'levels': np.maximum(levels, 0),
+            'triggered': triggered
+        }
+    
+    def evaluate_reading(self, reading):
+        """Evaluate a single posted reading as a 1 x 1 matrix"""
+        fields = {name: np.array([[reading[name]]], dtype=np.float64)
+                  for name in FIELDS if reading.get(name) is not None}
+        if not fields:
+            fields = {'rainfall': np.zeros((1, 1))}
+        result = self.evaluate(fields)
+        
+        score = float(result['scores'][0, 0])
+        return {
+            'warning_level': self.level_names[result['levels'][0, 0]],
+            'warning_score': int(score) if score.is_integer() else score,
+            'triggered_rules': [name for name, mask in result['triggered'].items() if mask[0, 0]]
+        }
+    
+    def find_transitions(self, levels, sites, times):
+        """List level changes along each site's timeline, starting from its last published level"""
+        initial = np.array([self.current_levels.get(site, 0) for site in sites], dtype=levels.dtype)
+        previous = np.concatenate((initial[:, np.newaxis], levels[:, :-1]), axis=1)
+        site_idx, step_idx = np.nonzero(levels != previous)
+        
+        return [{
+            'site': sites[s],
+            'time': times[t],
+            'step': int(t),
+            'from': self.level_names[previous[s, t]],
+            'to': self.level_names[levels[s, t]]
+        } for s, t in zip(site_idx, step_idx)]
+    
+    def evaluate_fleet(self, sites, fields, times, commit=False):
+        """Evaluate all sites and steps, returning current levels and transitions
+        
+        Transitions are relative to the published baseline; only a committing
+        caller moves that baseline, so read-only polling does not change it.
+        """
+        result = self.evaluate(fields)
+        levels = result['levels']
+        transitions = self.find_transitions(levels, sites, times)
+        
+        if commit:
+            # The first step is "now" and becomes the baseline for the next cycle
+            for i, site in enumerate(sites):
+                self.current_levels[site] = int(levels[i, 0])
+        
+        return {
+            'sites': {
+                site: {
+                    'warning_level': self.level_names[levels[i, 0]],
+                    'warning_score': float(result['scores'][i, 0]),
+                    'peak_level': self.level_names[levels[i].max()],
+                    'triggered_rules': [name for name, mask in result['triggered'].items() if mask[i].any()]
+                } for i, site in enumerate(sites)
+            },
+            'transitions': transitions
+        }
+
+def build_fleet_matrices(sensor_data, weather_reports, hours=24, step_hours=1, now=None):
+    """Stack sensor readings and forecast series into (sites, steps) matrices"""
+    now = now if now is not None else time.time()
+    sites = list(sensor_data.keys())
+    step_times = now / 3600 + np.arange(0, hours + step_hours, step_hours, dtype=np.float64)
+    shape = (len(sites), len(step_times))
+    
+    fields = {name: np.full(shape, np.nan) for name in FIELDS}
+    
+    for i, site in enumerate(sites):
+        # Predicted tide for every step where the site has a tide station,
+        # otherwise the sensor reading holds until the next sensor cycle
+        tide_level = sensor_data[site].get('tide_level')
+        if tide_engine.has_station(site):
+            fields['tide_level'][i] = tide_engine.level_at(site, step_times * 3600)
+        elif tide_level is not None:
+            fields['tide_level'][i] = tide_level
+        
+        series = getattr(weather_reports.get(site), 'series', None)
+        if series is None or len(series) == 0:
+            continue
+        
+        # Hourly record at or before each step
+        idx = np.searchsorted(series.epoch_hours, step_times, side='right') - 1
+        valid = (idx >= 0) & (step_times < series.epoch_hours[-1] + 1)
+        idx = np.clip(idx, 0, len(series) - 1)
+        
+        # Trailing 24h rainfall from the prefix sums, comparable to daily totals
+        end = idx + 1
+        start = np.searchsorted(series.epoch_hours, step_times - 23, side='left')
+        rainfall_24h = series.cum_rainfall[end] - series.cum_rainfall[np.minimum(start, end)]
+        
+        fields['rainfall'][i] = np.where(valid, rainfall_24h, np.nan)
+        fields['rainfall_rate'][i] = np.where(valid, series.rainfall[idx], np.nan)
+        fields['wind_speed'][i] = np.where(valid, series.wind[idx], np.nan)
+        fields['humidity'][i] = np.where(valid, series.humidity[idx], np.nan)
+    
+    times = [datetime.fromtimestamp(hour * 3600).isoformat() for hour in step_times]
+    return sites, fields, times
+
+# Global rule engine instance
+warning_engine = WarningRuleEngine.from_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'warning_rules.json'))
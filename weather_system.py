@@ -1,18 +1,140 @@
+import os
 import requests
 import json
 from datetime import datetime, timedelta
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from profiling import stage
+from metrics import WEATHER_API_CALLS, WEATHER_CACHE_LOOKUPS, RATE_LIMIT_WAITS, RATE_LIMIT_WAIT_SECONDS
+
+class ForecastSeries:
+    """Hourly forecast arrays with prefix sums for constant-time window queries"""
+    
+    def __init__(self, epoch_hours, rainfall, wind, humidity):
+        self.epoch_hours = np.asarray(epoch_hours, dtype=np.float64)
+        self.rainfall = np.nan_to_num(np.asarray(rainfall, dtype=np.float64))
+        self.wind = np.nan_to_num(np.asarray(wind, dtype=np.float64))
+        self.humidity = np.nan_to_num(np.asarray(humidity, dtype=np.float64))
+        
+        # Hourly records from the API are contiguous, so an index is pure arithmetic
+        self.regular = bool(np.all(np.diff(self.epoch_hours) == 1))
+        
+        # Time-weighted sums use hours since the first record to keep precision
+        self.origin = self.epoch_hours[0] if len(self.epoch_hours) else 0.0
+        relative_hours = self.epoch_hours - self.origin
+        
+        # Prefix sums with a leading zero: sum(x[i:j]) == cum[j] - cum[i]
+        def prefix(values):
+            return np.concatenate(([0.0], np.cumsum(values)))
+        
+        self.cum_count = np.arange(len(self.epoch_hours) + 1, dtype=np.float64)
+        self.cum_time = prefix(relative_hours)
+        self.cum_rainfall = prefix(self.rainfall)
+        self.cum_rainfall_time = prefix(self.rainfall * relative_hours)
+        self.cum_wind = prefix(self.wind)
+        self.cum_wind_time = prefix(self.wind * relative_hours)
+        self.cum_humidity = prefix(self.humidity)
+    
+    @classmethod
+    def from_forecast_days(cls, forecast_days):
+        """Build the arrays from WeatherAPI forecastday records"""
+        epoch_hours, rainfall, wind, humidity = [], [], [], []
+        
+        for day in forecast_days:
+            for hour in day.get('hour', []):
+                epoch = hour.get('time_epoch')
+                if epoch is None:
+                    epoch = datetime.strptime(hour.get('time', ''), '%Y-%m-%d %H:%M').timestamp()
+                epoch_hours.append(epoch / 3600)
+                rainfall.append(hour.get('precip_mm', np.nan))
+                wind.append(hour.get('wind_kph', np.nan))
+                humidity.append(hour.get('humidity', np.nan))
+        
+        return cls(np.array(epoch_hours, dtype=np.float64), np.array(rainfall, dtype=np.float64),
+                   np.array(wind, dtype=np.float64), np.array(humidity, dtype=np.float64))
+    
+    def __len__(self):
+        return len(self.epoch_hours)
+    
+    def window_bounds(self, start_hour, end_hour):
+        """Index range [i, j) of records with start_hour <= epoch hour <= end_hour"""
+        n = len(self.epoch_hours)
+        if n == 0:
+            return 0, 0
+        
+        if self.regular:
+            first = self.epoch_hours[0]
+            i = int(min(max(np.ceil(start_hour - first), 0), n))
+            j = int(min(max(np.floor(end_hour - first) + 1, 0), n))
+        else:
+            i = int(np.searchsorted(self.epoch_hours, start_hour, side='left'))
+            j = int(np.searchsorted(self.epoch_hours, end_hour, side='right'))
+        
+        return i, max(i, j)
+    
+    def window_features(self, timeframe_hours, now=None):
+        """Time-weighted rainfall and wind over the next timeframe_hours"""
+        now_hour = (now if now is not None else time.time()) / 3600
+        i, j = self.window_bounds(now_hour, now_hour + timeframe_hours)
+        
+        count = self.cum_count[j] - self.cum_count[i]
+        if count == 0:
+            return {
+                'forecast_rainfall': 0,
+                'forecast_rainfall_total': 0,
+                'forecast_wind_speed': 0,
+                'forecast_humidity': 0
+            }
+        
+        # Weight falls linearly from 1.0 now to 0.1 at the horizon:
+        # w = 1 - slope * (t - now), so sum(w * x) = S(x) - slope * (S(t * x) - now * S(x))
+        slope = 0.9 / timeframe_hours
+        now_relative = now_hour - self.origin
+        
+        def weighted(cum_values, cum_values_time):
+            total = cum_values[j] - cum_values[i]
+            timed = cum_values_time[j] - cum_values_time[i]
+            return total - slope * (timed - now_relative * total)
+        
+        total_weight = count - slope * ((self.cum_time[j] - self.cum_time[i]) - now_relative * count)
+        
+        return {
+            'forecast_rainfall': float(weighted(self.cum_rainfall, self.cum_rainfall_time) / total_weight),
+            'forecast_rainfall_total': float(self.cum_rainfall[j] - self.cum_rainfall[i]),
+            'forecast_wind_speed': float(weighted(self.cum_wind, self.cum_wind_time) / total_weight),
+            'forecast_humidity': float((self.cum_humidity[j] - self.cum_humidity[i]) / count)
+        }
+
+class WeatherReport(dict):
+    """Weather payload that also carries its ForecastSeries outside the JSON body"""
+    
+    def __init__(self, *args, series=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.series = series
 
 class WeatherSystem:
     def __init__(self):
         # You'll need to get a free API key from https://www.weatherapi.com/
         # Sign up and get your free API key (1000 requests per month)
-        self.api_key = "84b6782ee30a4551acc83954252608"  # Your real WeatherAPI.com key
-        self.base_url = "http://api.weatherapi.com/v1"
+        self.api_key = os.environ.get('WEATHER_API_KEY', "84b6782ee30a4551acc83954252608")  # Your real WeatherAPI.com key
+        # Point at a local stand-in (e.g. benchmarks/weather_stub.py) with WEATHER_API_BASE_URL
+        self.base_url = os.environ.get('WEATHER_API_BASE_URL', "http://api.weatherapi.com/v1")
         self.cache = {}
         self.cache_duration = 3600  # 1 hour cache
         self.last_api_call = 0
-        self.api_call_interval = 1  # 1 second between API calls to respect rate limits
+        self.api_call_interval = float(os.environ.get('WEATHER_API_CALL_INTERVAL', 1))  # 1 second between API calls to respect rate limits
+        self.api_burst = int(os.environ.get('WEATHER_API_BURST', 10))  # Calls allowed back to back before the interval applies
+        self.api_tokens = self.api_burst
+        self.rate_lock = threading.Lock()
+        # Bulk requests need a WeatherAPI.com Pro+ plan; without them fleet fetches run in parallel
+        self.bulk_enabled = os.environ.get('WEATHER_API_BULK', 'false').lower() in ('1', 'true', 'yes')
+        self.bulk_size = 50  # Locations per bulk request (the API maximum)
+        self.max_concurrency = int(os.environ.get('WEATHER_API_CONCURRENCY', 8))
+        self.site_index = None  # Optional SiteRegistry for snapping nearby queries
+        self.snap_distance_km = 5  # Queries this close to a site share its cache entry
         
     def get_api_key_instructions(self):
         """Return instructions for getting API key"""
@@ -28,89 +150,263 @@ class WeatherSystem:
             "current_status": "API key configured and ready"
         }
     
-    def make_api_request(self, endpoint, params):
-        """Make API request with rate limiting and error handling"""
+    def set_site_index(self, site_index, snap_distance_km=5):
+        """Use a site index so nearby coordinates reuse the same cached forecast"""
+        self.site_index = site_index
+        self.snap_distance_km = snap_distance_km
+    
+    def snap_coordinates(self, lat, lng):
+        """Move coordinates onto the nearest known site, if one is close enough"""
+        if self.site_index is None:
+            return lat, lng
+        snapped = self.site_index.snap(lat, lng, self.snap_distance_km)
+        return snapped if snapped is not None else (lat, lng)
+    
+    def cache_version(self, lat, lng, days=2):
+        """Fetch times of the cached current/forecast data for a location"""
+        lat, lng = self.snap_coordinates(lat, lng)
+        return tuple(self.cache.get(key, {}).get('timestamp')
+                     for key in (f"current_{lat}_{lng}", f"forecast_{lat}_{lng}_{days}"))
+    
+    def reserve_api_slot(self):
+        """Take a token from the rate limiter, returning the seconds to wait before calling"""
+        if self.api_call_interval <= 0:
+            return 0
+        
+        with self.rate_lock:
+            # Tokens refill one per interval up to the burst size; a negative balance is a queue
+            current_time = time.time()
+            elapsed = current_time - self.last_api_call
+            self.api_tokens = min(self.api_burst, self.api_tokens + elapsed / self.api_call_interval)
+            self.last_api_call = current_time
+            self.api_tokens -= 1
+            wait = max(0.0, -self.api_tokens * self.api_call_interval)
+        
+        if wait:
+            RATE_LIMIT_WAITS.inc()
+            RATE_LIMIT_WAIT_SECONDS.inc(wait)
+        return wait
+    
+    def handle_api_response(self, endpoint, status_code, get_json):
+        """Turn an API status code (and body) into data or an error dict"""
+        if status_code == 200:
+            WEATHER_API_CALLS.labels(endpoint, 'ok').inc()
+            return get_json()
+        elif status_code == 401:
+            WEATHER_API_CALLS.labels(endpoint, 'unauthorized').inc()
+            return {"error": "Invalid API key. Please check your WeatherAPI.com API key."}
+        elif status_code == 429:
+            WEATHER_API_CALLS.labels(endpoint, 'rate_limited').inc()
+            return {"error": "API rate limit exceeded. Please try again later."}
+        else:
+            WEATHER_API_CALLS.labels(endpoint, 'error').inc()
+            return {"error": f"Weather API error: {status_code}"}
+    
+    def handle_api_failure(self, endpoint, error):
+        """Error dict for a request that never got a response"""
+        WEATHER_API_CALLS.labels(endpoint, 'unavailable').inc()
+        return {"error": f"Weather data is currently unavailable. Please try again later. ({str(error)})"}
+    
+    def make_api_request(self, endpoint, params, body=None):
+        """Make API request with rate limiting and error handling (POSTed when there is a body)"""
         if not self.api_key or self.api_key == "YOUR_WEATHER_API_KEY_HERE":
             return {"error": "API key not configured", "instructions": self.get_api_key_instructions()}
         
         # Rate limiting
-        current_time = time.time()
-        if current_time - self.last_api_call < self.api_call_interval:
-            time.sleep(self.api_call_interval - (current_time - self.last_api_call))
+        wait = self.reserve_api_slot()
+        if wait:
+            time.sleep(wait)
         
         try:
             url = f"{self.base_url}/{endpoint}" 
             params['key'] = self.api_key
             
-            response = requests.get(url, params=params, timeout=10)
-            self.last_api_call = time.time()
+            with stage('weather_api'):
+                if body is None:
+                    response = requests.get(url, params=params, timeout=10)
+                else:
+                    response = requests.post(url, params=params, json=body, timeout=10)
             
-            if response.status_code == 200:
-                return response.json()
-            elif response.status_code == 401:
-                return {"error": "Invalid API key. Please check your WeatherAPI.com API key."}
-            elif response.status_code == 429:
-                return {"error": "API rate limit exceeded. Please try again later."}
-            else:
-                return {"error": f"Weather API error: {response.status_code}"}
+            return self.handle_api_response(endpoint, response.status_code, response.json)
                 
         except requests.exceptions.RequestException as e:
-            return {"error": f"Weather data is currently unavailable. Please try again later. ({str(e)})"}
+            return self.handle_api_failure(endpoint, e)
     
-    def get_weather_forecast(self, lat, lng, days=2):
-        """Get weather forecast for a location"""
-        cache_key = f"forecast_{lat}_{lng}_{days}"
-        
-        # Check cache
+    def get_cached(self, kind, cache_key):
+        """Cached data for a key if it is still fresh, else None"""
         if cache_key in self.cache:
             cached_data = self.cache[cache_key]
             if datetime.now().timestamp() - cached_data['timestamp'] < self.cache_duration:
+                WEATHER_CACHE_LOOKUPS.labels(kind, 'hit').inc()
                 return cached_data['data']
         
-        # Make API request
-        params = {
+        WEATHER_CACHE_LOOKUPS.labels(kind, 'miss').inc()
+        return None
+    
+    def store_forecast(self, cache_key, result):
+        """Cache a successful forecast, extracted once at ingest"""
+        if 'error' not in result:
+            with stage('weather_extract'):
+                extracted = self.extract_forecast_data(result)
+            # Published complete in one assignment, so readers never see an entry without 'extracted'
+            self.cache[cache_key] = {
+                'timestamp': datetime.now().timestamp(),
+                'data': result,
+                'extracted': extracted
+            }
+        return result
+    
+    def store_current(self, cache_key, result):
+        """Cache a successful current-weather result"""
+        if 'error' not in result:
+            self.cache[cache_key] = {
+                'timestamp': datetime.now().timestamp(),
+                'data': result
+            }
+        return result
+    
+    def forecast_request(self, lat, lng, days):
+        """(cache_key, params) for a forecast query, after snapping to a site"""
+        lat, lng = self.snap_coordinates(lat, lng)
+        return f"forecast_{lat}_{lng}_{days}", {
             'q': f"{lat},{lng}",
             'days': days,
             'aqi': 'no'
         }
+    
+    def current_request(self, lat, lng):
+        """(cache_key, params) for a current-weather query, after snapping to a site"""
+        lat, lng = self.snap_coordinates(lat, lng)
+        return f"current_{lat}_{lng}", {
+            'q': f"{lat},{lng}",
+            'aqi': 'no'
+        }
+    
+    def get_weather_forecast(self, lat, lng, days=2):
+        """Get weather forecast for a location"""
+        cache_key, params = self.forecast_request(lat, lng, days)
         
+        # Check cache
+        cached = self.get_cached('forecast', cache_key)
+        if cached is not None:
+            return cached
+        
+        # Make API request
         result = self.make_api_request('forecast.json', params)
         
-        if 'error' not in result:
-            # Cache successful results
-            self.cache[cache_key] = {
-                'timestamp': datetime.now().timestamp(),
-                'data': result
-            }
+        # Cache successful results
+        return self.store_forecast(cache_key, result)
+    
+    def lookup_extracted(self, lat, lng, days, result):
+        """The extraction stored alongside a forecast result"""
+        if 'error' in result:
+            return result
         
+        cache_key, _ = self.forecast_request(lat, lng, days)
+        cached_data = self.cache.get(cache_key)
+        if cached_data and cached_data['data'] is result:
+            return cached_data['extracted']
+        return self.extract_forecast_data(result)
+    
+    def get_extracted_forecast(self, lat, lng, days=2):
+        """Get the forecast already run through extract_forecast_data"""
+        return self.lookup_extracted(lat, lng, days, self.get_weather_forecast(lat, lng, days))
+    
+    def store_bulk_forecast(self, lat, lng, days, result):
+        """Cache a forecast and the current conditions it carries"""
+        cache_key, _ = self.forecast_request(lat, lng, days)
+        self.store_forecast(cache_key, result)
+        if 'error' not in result and 'current' in result:
+            current_key, _ = self.current_request(lat, lng)
+            self.store_current(current_key, {'location': result.get('location'), 'current': result['current']})
         return result
     
+    def fetch_bulk(self, pending, days):
+        """One bulk request for up to bulk_size locations: ({cache_key: result}, whether the call failed)"""
+        body = {'locations': [{'q': params['q'], 'custom_id': cache_key}
+                              for cache_key, (params, _) in pending.items()]}
+        result = self.make_api_request('forecast.json', {'q': 'bulk', 'days': days, 'aqi': 'no'}, body)
+        if 'error' in result:
+            return {cache_key: result for cache_key in pending}, True
+        
+        results = {}
+        for item in result.get('bulk', []):
+            query = item.get('query', {})
+            if query.get('custom_id') in pending:
+                results[query['custom_id']] = query if 'forecast' in query else \
+                    {"error": query.get('error', {}).get('message', 'No forecast returned for location')}
+        return results, False
+    
+    def get_weather_bulk(self, coordinates, days=2):
+        """Forecasts for many locations as {(lat, lng): forecast or error}, filling the caches"""
+        # Failed locations get their error dict without holding back the others
+        results = {}
+        pending = {}  # forecast cache key -> (params, [(lat, lng), ...])
+        
+        for lat, lng in coordinates:
+            cache_key, params = self.forecast_request(lat, lng, days)
+            current_key, _ = self.current_request(lat, lng)
+            cached = self.get_cached('forecast', cache_key)
+            if cached is not None and self.get_cached('current', current_key) is not None:
+                results[(lat, lng)] = cached
+            else:
+                pending.setdefault(cache_key, (params, []))[1].append((lat, lng))
+        
+        fetched = {}
+        final = set()  # Keys whose bulk call failed outright; retrying them singly would fail the same way
+        if self.bulk_enabled:
+            keys = list(pending)
+            for start in range(0, len(keys), self.bulk_size):
+                chunk = {key: pending[key] for key in keys[start:start + self.bulk_size]}
+                chunk_results, failed = self.fetch_bulk(chunk, days)
+                fetched.update(chunk_results)
+                if failed:
+                    final.update(chunk)
+        
+        # Locations the bulk answer left out or failed individually (or all, without bulk) are fetched in parallel
+        remaining = [key for key in pending if key not in final and (key not in fetched or 'error' in fetched[key])]
+        
+        def fetch_one(cache_key):
+            return self.make_api_request('forecast.json', dict(pending[cache_key][0]))
+        
+        if remaining:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(remaining))) as pool:
+                fetched.update(zip(remaining, pool.map(fetch_one, remaining)))
+        
+        for cache_key, (_, locations) in pending.items():
+            for lat, lng in locations:
+                results[(lat, lng)] = self.store_bulk_forecast(lat, lng, days, fetched[cache_key])
+        
+        return results
+    
+    def get_weather_for_rivers(self, rivers, include_hourly=False):
+        """Weather reports for {river_name: (lat, lng)}, fetched together"""
+        forecasts = self.get_weather_bulk(list(rivers.values()), days=2)
+        
+        reports = {}
+        for river_name, (lat, lng) in rivers.items():
+            forecast = forecasts[(lat, lng)]
+            current_key, _ = self.current_request(lat, lng)
+            current_weather = self.get_cached('current', current_key) or forecast
+            extracted_forecast = self.lookup_extracted(lat, lng, 2, forecast)
+            reports[river_name] = self.build_river_report(river_name, (lat, lng), current_weather,
+                                                          extracted_forecast, include_hourly)
+        return reports
+    
     def get_current_weather(self, lat, lng):
         """Get current weather for a location"""
-        cache_key = f"current_{lat}_{lng}"
+        cache_key, params = self.current_request(lat, lng)
         
         # Check cache
-        if cache_key in self.cache:
-            cached_data = self.cache[cache_key]
-            if datetime.now().timestamp() - cached_data['timestamp'] < self.cache_duration:
-                return cached_data['data']
+        cached = self.get_cached('current', cache_key)
+        if cached is not None:
+            return cached
         
         # Make API request
-        params = {
-            'q': f"{lat},{lng}",
-            'aqi': 'no'
-        }
-        
         result = self.make_api_request('current.json', params)
         
-        if 'error' not in result:
-            # Cache successful results
-            self.cache[cache_key] = {
-                'timestamp': datetime.now().timestamp(),
-                'data': result
-            }
-        
-        return result
+        # Cache successful results
+        return self.store_current(cache_key, result)
     
     def extract_forecast_data(self, forecast_data):
         """Extract relevant forecast data for debris prediction"""
@@ -125,7 +421,8 @@ class WeatherSystem:
             extracted_data = {
                 'location': forecast_data.get('location', {}),
                 'current': forecast_data.get('current', {}),
-                'forecast': []
+                'forecast': [],
+                'series': ForecastSeries.from_forecast_days(forecast)
             }
             
             for day in forecast:
@@ -161,41 +458,38 @@ class WeatherSystem:
         except Exception as e:
             return {"error": f"Error processing forecast data: {str(e)}"}
     
-    def get_weather_for_river(self, river_name, coordinates):
+    def get_weather_for_river(self, river_name, coordinates, include_hourly=False):
         """Get weather data for a specific river location"""
         lat, lng = coordinates
         
-        print(f"Getting weather for {river_name} at coordinates {lat}, {lng}")
-        
         # Get current weather
         current_weather = self.get_current_weather(lat, lng)
-        print(f"Current weather result: {current_weather}")
         
-        # Get forecast
-        forecast_weather = self.get_weather_forecast(lat, lng, days=2)
-        print(f"Forecast weather result: {forecast_weather}")
+        # Get forecast, extracted when it was fetched
+        extracted_forecast = self.get_extracted_forecast(lat, lng, days=2)
         
+        return self.build_river_report(river_name, coordinates, current_weather, extracted_forecast, include_hourly)
+    
+    def build_river_report(self, river_name, coordinates, current_weather, extracted_forecast, include_hourly=False):
+        """Combine current weather and an extracted forecast into a river's weather report"""
         # Check if we got valid forecast data
-        if 'error' in forecast_weather:
-            print(f"Forecast error: {forecast_weather['error']}")
-            return {"error": f"Forecast failed: {forecast_weather['error']}"}
-        
-        # Extract forecast data in the correct format
-        extracted_forecast = self.extract_forecast_data(forecast_weather)
-        
-        # If extraction failed, return error
         if 'error' in extracted_forecast:
-            print(f"Extraction error: {extracted_forecast['error']}")
-            return {"error": f"Data extraction failed: {extracted_forecast['error']}"}
+            print(f"Forecast error: {extracted_forecast['error']}")
+            return {"error": f"Forecast failed: {extracted_forecast['error']}"}
+        
+        # The per-hour records are large, so only send them when asked
+        forecast_days = extracted_forecast.get('forecast', [])
+        if not include_hourly:
+            forecast_days = [{k: v for k, v in day.items() if k != 'hourly'} for day in forecast_days]
         
         # Extract and combine data
-        result = {
+        result = WeatherReport({
             'river_name': river_name,
             'coordinates': coordinates,
             'timestamp': datetime.now().isoformat(),
             'current': current_weather,
-            'forecast': extracted_forecast.get('forecast', [])  # Use the forecast array directly
-        }
+            'forecast': forecast_days  # Use the forecast array directly
+        }, series=extracted_forecast.get('series'))
         
         return result
     
@@ -246,7 +540,6 @@ class WeatherSystem:
             'note': 'Using mock weather data (API key not configured)'
         }
         
-        print(f"Mock weather result: {result}")  # Debug log
         return result
 
 # Global weather system instance